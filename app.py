@@ -1,12 +1,23 @@
 # main.py - Main application file
 
 import streamlit as st
-from modules.auth import check_authentication, initialize_auth_state, handle_login, handle_register, handle_logout
-from modules.chat import initialize_chat_state, handle_chat, create_new_chat, get_chat_messages, get_user_chats, save_message
-from modules.db import get_db_connections, handle_database_connection, save_db_connection, get_db_connection_by_id
-from modules.query import get_chat_queries, save_query
+from modules.auth import check_authentication, initialize_auth_state, handle_login, handle_register, handle_logout, get_session_cache_stats, get_session_sweeper_stats, start_session_sweeper
+from modules.chat import initialize_chat_state, handle_chat, run_confirmed_query, create_new_chat, get_user_chats, get_message_cache, sync_message_cache, load_earlier_messages, CHAT_LIST_PAGE_SIZE
+from modules.db import get_db_connections, handle_database_connection, save_db_connection, get_db_connection_by_id, get_connection_info
+from modules.query import get_chat_queries, get_query_result
 from modules.nav import get_query_params, set_query_params, navigate_to
-from modules.db_setup import create_tables
+from modules.migrations import run_migrations
+from modules.engine_registry import get_open_query_db, get_registry_stats, get_query_db
+from modules.executor import fetch_next_page, is_pageable
+from modules.schema_cache import refresh_schema
+from modules.sql_cache import get_sql_cache_stats
+from modules.result_cache import get_result_cache_stats
+from modules.persistence import get_persistence_stats
+from modules.tracing import register_gauge, start_metrics_server
+from modules.preflight import get_guard_settings
+from modules.routing import get_routing_stats
+from modules.profiler import DB_PROFILE, dump_profiles, finish_profile, start_profile
+from modules.ingest import IMPORT_DIR, ingest_files, resolve_import_path
 import os
 
 # Enhanced UI Configuration - Must be the first Streamlit command
@@ -61,12 +72,43 @@ def apply_styling():
         </style>
     """, unsafe_allow_html=True)
 
+def setup_metrics():
+    register_gauge("write_queue_depth", "Chat turns waiting to be written.", lambda: get_persistence_stats()["queue_depth"])
+    register_gauge("write_flush_seconds", "Duration of the last write-behind flush.", lambda: get_persistence_stats()["last_flush_seconds"])
+    register_gauge("sql_cache_hit_rate", "Hit rate of the generated SQL cache.", lambda: get_sql_cache_stats()["hit_rate"])
+    register_gauge("result_cache_bytes", "Bytes held by the query result cache.", lambda: get_result_cache_stats()["bytes"])
+    register_gauge("engine_registry_entries", "Open query engines.", lambda: get_registry_stats()["entries"])
+    start_metrics_server()
+
+# Number of rerun query profiles kept per session
+PROFILE_HISTORY = 20
+
 def main():
-    # Set up the database tables
+    # Record the lang2sql queries of this rerun when profiling is on
+    profile_token = None
+    if st.session_state.get("db_profile", DB_PROFILE):
+        profile_token = start_profile(st.session_state.get("page", "login"))
+    
+    try:
+        run_page()
+    finally:
+        # Also reached when the page ends early with st.rerun()
+        if profile_token is not None:
+            report = finish_profile(profile_token)
+            st.session_state.db_profiles = (st.session_state.get("db_profiles", []) + [report])[-PROFILE_HISTORY:]
+
+def run_page():
+    # Bring the database schema up to date (once per process)
     try:
-        create_tables()
+        run_migrations()
     except Exception as e:
-        st.error(f"Failed to create tables: {str(e)}")
+        st.error(f"Failed to migrate database: {str(e)}")
+    
+    # Delete expired sessions in the background (once per process)
+    start_session_sweeper()
+    
+    # Prometheus metrics on METRICS_PORT, if set
+    setup_metrics()
     
     # Initialize session state
     initialize_auth_state()
@@ -102,6 +144,11 @@ def render_sidebar():
                 
             if st.button("📤 Logout"):
                 handle_logout()
+            
+            # Opt-in profile of the queries each rerun sends to the lang2sql database
+            st.toggle("Profile database queries", value=DB_PROFILE, key="db_profile")
+            if st.session_state.db_profile and st.session_state.get("db_profiles"):
+                render_query_profile()
         else:
             st.warning("⚠ Not logged in")
             
@@ -176,8 +223,20 @@ def render_register_page():
 def render_chat_page():
     st.title("🔍 Database Chat Assistant")
     
-    # Get user's chats
-    chats = get_user_chats(st.session_state.user_id)
+    # Get one page more of the user's chats than is shown, to know whether there are more
+    if "chat_list_limit" not in st.session_state:
+        st.session_state.chat_list_limit = CHAT_LIST_PAGE_SIZE
+    chats = get_user_chats(st.session_state.user_id, limit=st.session_state.chat_list_limit + 1)
+    has_more_chats = len(chats) > st.session_state.chat_list_limit
+    chats = chats[:st.session_state.chat_list_limit]
+    
+    # Open the latest chat after login or a page reload, creating one for new users
+    if st.session_state.current_chat_id is None:
+        if chats:
+            st.session_state.current_chat_id = chats[0]['chat_id']
+        else:
+            st.session_state.current_chat_id = create_new_chat(st.session_state.user_id)
+            chats = get_user_chats(st.session_state.user_id, limit=st.session_state.chat_list_limit)
     
     # Sidebar for chat selection and settings
     with st.sidebar:
@@ -193,7 +252,7 @@ def render_chat_page():
         
         # List of existing chats
         for chat in chats:
-            chat_title = chat['first_message']
+            chat_title = chat['title'] or "New chat"
             if len(chat_title) > 30:
                 chat_title = chat_title[:30] + "..."
                 
@@ -202,32 +261,67 @@ def render_chat_page():
                 st.session_state.current_chat_id = chat['chat_id']
                 st.rerun()
         
+        if has_more_chats:
+            if st.button("Show more chats", key="more_chats"):
+                st.session_state.chat_list_limit += CHAT_LIST_PAGE_SIZE
+                st.rerun()
+        
         st.markdown("---")
         
         # Database source selector
         render_source_selectors()
+        
+        # Generated SQL cache switch
+        st.session_state.bypass_sql_cache = st.checkbox(
+            "Bypass SQL cache",
+            value=st.session_state.bypass_sql_cache,
+            help="Always ask the model for fresh SQL"
+        )
+        cache_stats = get_sql_cache_stats()
+        st.caption(f"SQL cache hit rate: {cache_stats['hit_rate']:.0%} ({cache_stats['hits']} hits, {cache_stats['misses']} misses)")
+        
+        # Debug panel with the stage timings of the last turn
+        st.session_state.show_turn_timings = st.toggle(
+            "Show turn timings",
+            value=st.session_state.get("show_turn_timings", False)
+        )
     
     # Main chat area
     if st.session_state.current_chat_id:
-        # Get chat messages
-        messages = get_chat_messages(st.session_state.current_chat_id)
+        # Get chat messages, reading only the ones this session has not seen
+        message_cache = get_message_cache(st.session_state.current_chat_id)
+        messages = sync_message_cache(message_cache)
+        
+        # Older messages are loaded on demand
+        if message_cache["has_earlier"]:
+            if st.button("⬆️ Load earlier messages", key="load_earlier_messages"):
+                load_earlier_messages(message_cache)
+                st.rerun()
         
         # Chat interface
         chat_container = st.container()
         with chat_container:
             for message in messages:
-                # Fix: Check message type using isinstance with proper class
-                from langchain_core.messages import AIMessage, HumanMessage
-                if isinstance(message, AIMessage):
+                if message['is_system']:
                     with st.chat_message("assistant", avatar="🤖"):
-                        st.markdown(message.content)
-                elif isinstance(message, HumanMessage):
+                        st.markdown(message['content'])
+                else:
                     with st.chat_message("user", avatar="👤"):
-                        st.markdown(message.content)
+                        st.markdown(message['content'])
+        
+        # Structured rows of the latest query
+        render_query_result()
+        
+        # A query waiting for the user to confirm its cost
+        render_pending_query()
         
         # Source indicator
         render_source_indicator()
         
+        # Stage timings of the previous turn
+        if st.session_state.show_turn_timings:
+            render_turn_timings()
+        
         # Input area
         handle_chat()
     else:
@@ -268,6 +362,107 @@ def render_source_selectors():
                     break
         st.rerun()
 
+def render_query_result():
+    last = st.session_state.last_query_result
+    if not last or last["chat_id"] != st.session_state.current_chat_id:
+        return
+    
+    page = last["pages"][-1]
+    if not page["columns"]:
+        return
+    
+    import pandas as pd
+    with st.expander("📋 Query result", expanded=True):
+        st.dataframe(pd.DataFrame(page["rows"], columns=page["columns"]), use_container_width=True)
+        
+        first_row = sum(previous["row_count"] for previous in last["pages"][:-1]) + 1
+        more = " (more available)" if page["truncated"] else ""
+        st.caption(f"Rows {first_row}-{first_row + page['row_count'] - 1}{more}")
+        
+        # Fetch the following rows on demand
+        if page["truncated"] and is_pageable(last["sql"]):
+            if st.button("Next page ➡️", key="result_next_page"):
+                try:
+                    db_info = get_db_connection_by_id(last["db_id"])
+                    connection_info = get_connection_info(db_info)
+                    db = get_query_db(last["db_id"], connection_info)
+                    timeout_ms = get_guard_settings(connection_info)["timeout_ms"]
+                    last["pages"].append(fetch_next_page(db, last["sql"], page, timeout_ms=timeout_ms))
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Failed to fetch the next page: {str(e)}")
+
+def render_pending_query():
+    pending = st.session_state.pending_query
+    if not pending or pending["chat_id"] != st.session_state.current_chat_id or pending["db_id"] != st.session_state.active_db_id:
+        return
+    
+    st.warning(f"This query would read about {pending['estimated_rows']:,} rows")
+    st.code(pending["sql"], language="sql")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("▶️ Run anyway", key="confirm_pending_query"):
+            run_confirmed_query()
+    with col2:
+        if st.button("Cancel", key="cancel_pending_query"):
+            st.session_state.pending_query = None
+            st.rerun()
+
+def render_query_profile():
+    profiles = st.session_state.db_profiles
+    report = profiles[-1]
+    with st.expander(f"🔬 Previous rerun: {report['round_trips']} round trips", expanded=False):
+        st.caption(
+            f"{report['label']} page: {report['statement_count']} statements, {report['checkouts']} connection checkouts, "
+            f"{report['rows']} rows, {report['total_seconds'] * 1000:.1f} ms in queries"
+        )
+        
+        for finding in report["n_plus_one"]:
+            st.warning(f"N+1: {finding['count']}× with {finding['distinct_params']} different parameters from {', '.join(finding['callers'])}: {finding['statement'][:120]}")
+        for finding in report["duplicates"]:
+            st.warning(f"Duplicate: {finding['count']}× identical from {', '.join(finding['callers'])}: {finding['statement'][:120]}")
+        
+        st.dataframe(
+            [
+                {
+                    "caller": entry["caller"],
+                    "via": entry["via"],
+                    "ms": round(entry["seconds"] * 1000, 2),
+                    "rows": entry["rows"],
+                    "statement": entry["statement"]
+                }
+                for entry in report["statements"]
+            ],
+            hide_index=True
+        )
+        
+        st.download_button(
+            f"Download last {len(profiles)} profiles",
+            dump_profiles(profiles),
+            file_name="query_profiles.json",
+            mime="application/json"
+        )
+
+def render_turn_timings():
+    trace = st.session_state.last_turn_trace
+    with st.expander("⏱️ Turn timings", expanded=True):
+        if not trace:
+            st.caption("No turn answered yet in this session")
+            return
+        
+        st.dataframe(
+            [{"stage": name, "ms": round(seconds * 1000, 1)} for name, seconds in trace["stages"].items()],
+            hide_index=True
+        )
+        for call, usage in trace["tokens"].items():
+            st.caption(f"{call} prompt: {usage.get('prompt_tokens', 0)} tokens in, {usage.get('response_tokens', 0)} tokens out")
+        if trace["row_count"] is not None:
+            st.caption(f"{trace['row_count']} result rows")
+        if trace["routed_to"]:
+            st.caption(f"Ran on {trace['routed_to']}")
+        if trace["preflight"] and trace["preflight"]["estimated_rows"] is not None:
+            st.caption(f"Pre-flight: {trace['preflight']['action']}, about {trace['preflight']['estimated_rows']:,} rows read")
+
 def render_source_indicator():
     source_info = ""
     if st.session_state.active_db_id:
@@ -296,12 +491,89 @@ def render_databases_page():
                     <p>Type: {db['db_type']}</p>
                 </div>
                 """, unsafe_allow_html=True)
+                
+                # Drop the cached schema so the next question re-reads it
+                if st.button("🔄 Refresh schema", key=f"refresh_schema_{db['db_id']}"):
+                    refresh_schema(db['db_id'])
+                    st.success(f"✅ Schema for {db['db_name']} will be reloaded on the next question")
+                
+                # Where reads went, for connections with replicas and an open engine
+                open_db = get_open_query_db(db['db_id'])
+                routing = get_routing_stats(open_db) if open_db is not None else None
+                if routing:
+                    replicas = ", ".join(
+                        f"{replica['name']}: {replica['routed']} reads, {replica['failures']} failures{'' if replica['up'] else ' (down)'}"
+                        for replica in routing["replicas"]
+                    )
+                    st.caption(f"Replica routing ({routing['policy']}): {routing['primary_reads']} reads on the primary; {replicas}")
     else:
         st.info("No database connections saved yet.")
     
+    # Engine registry counters
+    stats = get_registry_stats()
+    st.caption(f"Engine cache: {stats['entries']} open, {stats['hits']} hits, {stats['misses']} misses")
+    result_stats = get_result_cache_stats()
+    st.caption(f"Result cache: {result_stats['entries']} results, {result_stats['bytes'] / 1024:.0f} KiB, {result_stats['hits']} hits, {result_stats['misses']} misses")
+    session_stats = get_session_cache_stats()
+    st.caption(f"Session cache: {session_stats['entries']} tokens, {session_stats['hits']} hits, {session_stats['misses']} misses")
+    sweep_stats = get_session_sweeper_stats()
+    st.caption(f"Session sweeper: {sweep_stats['passes']} passes, {sweep_stats['last_deleted']} expired sessions deleted last pass, {sweep_stats['total_deleted']} in total")
+    write_stats = get_persistence_stats()
+    st.caption(f"Write queue: {write_stats['queue_depth']} turns queued, {write_stats['turns_written']} written, last flush {write_stats['last_flush_seconds'] * 1000:.0f} ms, average {write_stats['avg_flush_seconds'] * 1000:.0f} ms")
+    
+    # Import spreadsheets into a new SQLite connection
+    render_file_import()
+    
     # Add new database connection form
     handle_database_connection()
 
+def render_file_import():
+    st.markdown("### 📥 Import CSV / Excel")
+    uploads = st.file_uploader("Files", type=["csv", "xlsx", "xls"], accept_multiple_files=True, key="import_files")
+    # Uploads are buffered in memory by Streamlit; large files are better read from the import directory
+    server_path = ""
+    if IMPORT_DIR:
+        server_path = st.text_input(f"Or a file in {IMPORT_DIR} on the server", key="import_path")
+    import_name = st.text_input("Connection name", key="import_name")
+    
+    if st.button("Import", key="import_button"):
+        files = [(upload, upload.name) for upload in uploads or []]
+        if server_path.strip():
+            try:
+                files.append((resolve_import_path(server_path.strip()), server_path.strip()))
+            except ValueError as e:
+                st.error(str(e))
+                return
+        if not files or not import_name.strip():
+            st.error("Choose at least one file and a connection name")
+            return
+        
+        status = st.empty()
+        def progress(table, rows):
+            status.text(f"{table}: {rows:,} rows loaded")
+        
+        try:
+            with st.spinner("Importing..."):
+                imported = ingest_files(files, import_name.strip(), progress=progress)
+        except Exception as e:
+            st.error(f"Import failed: {str(e)}")
+            return
+        
+        tables = ", ".join(f"{table} ({rows:,} rows)" for table, rows in imported["tables"].items())
+        st.success(f"✅ Imported {tables}")
+        st.rerun()
+
+def render_stored_result(result):
+    if isinstance(result, dict) and result.get("columns"):
+        import pandas as pd
+        st.dataframe(pd.DataFrame(result["rows"], columns=result["columns"]), use_container_width=True)
+        if result.get("truncated"):
+            st.caption("Result was truncated when it was fetched")
+    elif isinstance(result, dict):
+        st.markdown(f"{result.get('rows_affected', 0)} rows affected")
+    else:
+        st.markdown(result)
+
 def render_history_page():
     st.title("📊 Query History")
     
@@ -340,7 +612,16 @@ def render_history_page():
                     st.markdown("**Generated SQL:**")
                     st.code(query['generated_sql'], language="sql")
                     st.markdown("**Result:**")
-                    st.markdown(query['result'])
+                    if query['row_count'] is not None:
+                        st.caption(f"{query['row_count']} rows, {query['byte_size']} bytes ({query['stored_size']} stored)")
+                    if query['duration_ms'] is not None:
+                        st.caption(f"Answered in {query['duration_ms']} ms, {query['prompt_tokens']} prompt tokens, {query['response_tokens']} response tokens")
+                    if query['routed_to']:
+                        st.caption(f"Ran on {query['routed_to']}")
+                    
+                    # Results are only loaded and decompressed when asked for
+                    if st.toggle("Show result", key=f"show_result_{query['query_id']}"):
+                        render_stored_result(get_query_result(query['query_id']))
         else:
             st.info("No queries found for this chat.")
     else:
@@ -0,0 +1,123 @@
+# benchmarks/import_profile.py - Import-time cost of the app's cold start
+#
+# Imports app.py (what Streamlit does before the login page can render)
+# in a fresh interpreter with -X importtime, and reports the most
+# expensive modules by cumulative import time. Heavy SDKs that must only
+# load on first real use are checked separately: the run fails if the
+# cold start pulls any of them in.
+#
+#   python -m benchmarks.import_profile --runs 5
+#
+# Results are written as JSON named after the commit, like the other
+# benchmarks, so cold-start cost can be compared across commits.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages the login and register pages must never import
+LAZY_PACKAGES = ["langchain", "langchain_core", "langchain_community", "google.generativeai", "sqlalchemy", "pandas"]
+
+# Imported on first use by the chat page, measured separately for comparison
+DEFERRED_IMPORTS = {
+    "langchain_community.utilities": "from langchain_community.utilities import SQLDatabase",
+    "google.generativeai": "import google.generativeai",
+    "sqlalchemy": "import sqlalchemy"
+}
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def profile_imports(statement):
+    """Run statement in a fresh interpreter and return {module: (self_us, cumulative_us, depth)}"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{completed.stderr[-2000:]}")
+
+    modules = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+def summarize(runs, top):
+    """Median cumulative and self time per module over several runs"""
+    names = set().union(*runs)
+    modules = []
+    for name in names:
+        samples = [run[name] for run in runs if name in run]
+        modules.append({
+            "module": name,
+            "cumulative_ms": statistics.median(sample[1] for sample in samples) / 1000,
+            "self_ms": statistics.median(sample[0] for sample in samples) / 1000,
+            "depth": samples[0][2]
+        })
+    modules.sort(key=lambda module: module["cumulative_ms"], reverse=True)
+    total = statistics.median(sum(sample[0] for sample in run.values()) for run in runs) / 1000
+    return {"total_ms": total, "module_count": len(names), "top": modules[:top]}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the import time of the app's cold start")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement (median is reported)")
+    parser.add_argument("--top", type=int, default=25, help="modules listed by cumulative import time")
+    parser.add_argument("--output", help="result file (default benchmarks/results/import_profile_<commit>.json)")
+    args = parser.parse_args()
+
+    runs = [profile_imports("import app") for _ in range(args.runs)]
+    cold_start = summarize(runs, args.top)
+
+    # Heavy packages that the cold start pulled in anyway
+    loaded = set().union(*runs)
+    eager = [package for package in LAZY_PACKAGES if package in loaded]
+
+    deferred = {}
+    for name, statement in DEFERRED_IMPORTS.items():
+        try:
+            deferred[name] = summarize([profile_imports(statement) for _ in range(args.runs)], 0)["total_ms"]
+        except RuntimeError:
+            deferred[name] = None
+
+    print(f"== import app: {cold_start['total_ms']:.0f} ms, {cold_start['module_count']} modules ==")
+    for module in cold_start["top"]:
+        print(f"{module['cumulative_ms']:9.1f} ms cumulative {module['self_ms']:8.1f} ms self  {'  ' * module['depth']}{module['module']}")
+    print("\n== deferred to first use ==")
+    for name, total in deferred.items():
+        print(f"{name:<32} " + (f"{total:.0f} ms" if total is not None else "not installed"))
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"import_profile_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args),
+            "cold_start": cold_start,
+            "eager_heavy_imports": eager,
+            "deferred_ms": deferred
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if eager:
+        print(f"\nCold start imports packages that should load lazily: {', '.join(eager)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# benchmarks/migration_indexes.py - Query plans of hot lookups before and after the index migration
+#
+# Seeds a scratch MySQL database with users, chats, messages, queries and
+# sessions, runs EXPLAIN on the app's hot lookups with every migration but
+# the index migration applied, creates its indexes and runs EXPLAIN again.
+# The lookups read columns added by later migrations, so they cannot run
+# at schema version 1.
+#
+#   DB_NAME=lang2sql_bench python -m benchmarks.migration_indexes --messages 2000000
+#
+# DB_NAME must point at a database that can be dropped and refilled.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.db_utils import db_connection, get_db_config
+from modules.migrations import MIGRATIONS, run_migrations
+
+# Hot lookups of the app, as modules/chat.py and modules/query.py run them,
+# with parameters filled in from the seeded data
+HOT_QUERIES = {
+    "chat messages": "SELECT * FROM message WHERE chat_id = %(chat_id)s ORDER BY message_id DESC LIMIT %(limit)s",
+    "earlier messages": (
+        "SELECT * FROM message WHERE chat_id = %(chat_id)s AND message_id < %(message_id)s "
+        "ORDER BY message_id DESC LIMIT %(limit)s"
+    ),
+    "new messages": (
+        "SELECT * FROM message WHERE chat_id = %(chat_id)s AND message_id > %(message_id)s "
+        "ORDER BY message_id ASC"
+    ),
+    "chat queries": (
+        "SELECT q.query_id, q.chat_id, q.db_id, q.natural_language_query, "
+        "q.generated_sql, q.timestamp, db.db_name, "
+        "q.duration_ms, q.prompt_tokens, q.response_tokens, q.routed_to, "
+        "r.row_count, r.byte_size, r.stored_size "
+        "FROM query q "
+        "LEFT JOIN database_connection db ON q.db_id = db.db_id "
+        "LEFT JOIN query_result r ON r.query_id = q.query_id "
+        "WHERE q.chat_id = %(chat_id)s "
+        "ORDER BY q.timestamp ASC"
+    ),
+    "user chats": (
+        "SELECT chat_id, created_at, title, last_activity_at FROM chat WHERE user_id = %(user_id)s "
+        "ORDER BY created_at DESC, chat_id DESC LIMIT %(chat_limit)s"
+    )
+}
+
+# Page sizes the app uses (CHAT_PAGE_SIZE + 1 and CHAT_LIST_PAGE_SIZE in modules/chat.py)
+MESSAGE_PAGE_ROWS = 51
+CHAT_LIST_ROWS = 20
+
+BATCH_SIZE = 5000
+
+# Version of the index migration
+INDEX_MIGRATION = 2
+
+def drop_tables(cursor):
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+    cursor.execute("SHOW TABLES")
+    for (table,) in cursor.fetchall():
+        cursor.execute(f"DROP TABLE `{table}`")
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+def insert_batches(conn, cursor, statement, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        cursor.executemany(statement, rows[start:start + BATCH_SIZE])
+        conn.commit()
+
+def seed(conn, users, chats_per_user, messages):
+    """Fill the scratch database and return the parameters used by HOT_QUERIES"""
+    cursor = conn.cursor()
+    rng = random.Random(42)
+
+    insert_batches(conn, cursor, "INSERT INTO users (username, password, email) VALUES (%s, %s, %s)",
+                   [(f"user{i}", "x", f"user{i}@example.com") for i in range(users)])
+
+    tokens = [str(uuid.uuid4()) for _ in range(users)]
+    insert_batches(conn, cursor, "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL 30 DAY)",
+                   [(i + 1, tokens[i]) for i in range(users)])
+
+    chat_count = users * chats_per_user
+    insert_batches(conn, cursor, "INSERT INTO chat (user_id, created_at) VALUES (%s, NOW() - INTERVAL %s MINUTE)",
+                   [(i % users + 1, rng.randint(0, 500000)) for i in range(chat_count)])
+
+    # Messages are generated and inserted batch by batch to bound memory
+    for start in range(0, messages, BATCH_SIZE):
+        rows = [
+            (rng.randint(1, chat_count), f"message {n}", n % 2, rng.randint(0, 500000))
+            for n in range(start, min(start + BATCH_SIZE, messages))
+        ]
+        cursor.executemany(
+            "INSERT INTO message (chat_id, content, is_system, timestamp) VALUES (%s, %s, %s, NOW() - INTERVAL %s MINUTE)",
+            rows
+        )
+        conn.commit()
+
+    insert_batches(conn, cursor, "INSERT INTO query (chat_id, natural_language_query, generated_sql) VALUES (%s, %s, %s)",
+                   [(rng.randint(1, chat_count), "question", "SELECT 1") for _ in range(messages // 4)])
+
+    cursor.execute("ANALYZE TABLE users, sessions, chat, message, query")
+    cursor.fetchall()
+    cursor.close()
+
+    return {
+        "chat_id": rng.randint(1, chat_count),
+        "user_id": rng.randint(1, users),
+        "message_id": messages // 2,
+        "limit": MESSAGE_PAGE_ROWS,
+        "chat_limit": CHAT_LIST_ROWS
+    }
+
+def apply_migrations(conn, index_migration):
+    """Apply the steps of the migrations after version 1, with or without the index migration"""
+    cursor = conn.cursor()
+    for version, _, steps in MIGRATIONS:
+        if version == 1 or (version == INDEX_MIGRATION) != index_migration:
+            continue
+        for step in steps:
+            if callable(step):
+                step(conn, cursor)
+            else:
+                cursor.execute(step)
+    conn.commit()
+    cursor.execute("ANALYZE TABLE sessions, chat, message, query")
+    cursor.fetchall()
+    cursor.close()
+
+def explain_all(conn, params):
+    """EXPLAIN and time each hot query"""
+    cursor = conn.cursor(dictionary=True)
+    plans = {}
+    for name, query in HOT_QUERIES.items():
+        cursor.execute("EXPLAIN " + query, params)
+        plan = cursor.fetchall()
+
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        elapsed = time.perf_counter() - start
+
+        plans[name] = {
+            "plan": [{key: row[key] for key in ("table", "type", "key", "rows", "Extra")} for row in plan],
+            "seconds": elapsed
+        }
+    cursor.close()
+    return plans
+
+def print_plans(title, plans):
+    print(f"\n== {title} ==")
+    for name, result in plans.items():
+        for row in result["plan"]:
+            print(f"{name:<16} type={row['type']:<6} key={str(row['key']):<28} rows={row['rows']:<9} {row['Extra'] or ''}")
+        print(f"{'':<16} {result['seconds'] * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare query plans before and after the index migration")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=2000000)
+    parser.add_argument("--output", default="benchmarks/results/migration_indexes.json")
+    parser.add_argument("--force", action="store_true", help="allow a DB_NAME without 'bench' in it")
+    args = parser.parse_args()
+
+    # Every table in DB_NAME is dropped, so refuse to touch a real database by accident
+    database = get_db_config()["database"]
+    if "bench" not in database and not args.force:
+        parser.error(f"refusing to drop the tables of {database!r}; set DB_NAME to a scratch database or pass --force")
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        drop_tables(cursor)
+        cursor.close()
+
+    # Base tables only, as deployed before the index migration; the later
+    # migrations are applied by hand so the index migration can come last
+    run_migrations(target_version=1)
+    with db_connection() as conn:
+        apply_migrations(conn, index_migration=False)
+        params = seed(conn, args.users, args.chats_per_user, args.messages)
+        before = explain_all(conn, params)
+
+        apply_migrations(conn, index_migration=True)
+        after = explain_all(conn, params)
+
+    print_plans("before", before)
+    print_plans("after", after)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"args": vars(args), "before": before, "after": after}, f, indent=2, default=str)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+# benchmarks/turn_pipeline.py - Offline benchmark of the NL->SQL chat turn pipeline
+#
+# Runs scenario questions through the same stages as a chat turn (engine,
+# schema, history compaction, schema selection, SQL generation and
+# execution, streamed answer) against SQLite fixture databases of
+# increasing schema size. Prompts go to a deterministic stub backend with
+# configurable latency, so neither Gemini nor MySQL is needed.
+#
+#   python -m benchmarks.turn_pipeline --tables 10 100 1000 --latency 0.2
+#   python -m benchmarks.turn_pipeline --compare benchmarks/results/turn_pipeline_<commit>.json
+#
+# Results (p50/p95 per stage, database round trips per turn, prompt sizes
+# and memory high-water marks) are written as JSON named after the commit.
+
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from modules.chat import get_response
+from modules.engine_registry import get_query_db
+from modules.history import compact_history
+from modules.llm import estimate_tokens, set_backend
+from modules.pipeline import run_stages
+from modules.preflight import get_guard_settings
+from modules.schema_cache import load_schema
+from modules.schema_index import select_schema
+from modules.tracing import new_trace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+
+# Fixture tables are named <entity>_<n>; the first ten exist in every fixture
+ENTITIES = ["customer", "order", "product", "invoice", "shipment",
+            "supplier", "payment", "employee", "department", "region"]
+
+STAGES = ["engine", "schema", "compact_history", "select_schema", "generate_and_run",
+          "generate_sql", "preflight", "execute_sql", "answer", "total"]
+
+# Round trips counted on every SQLAlchemy engine, i.e. against the target database
+_round_trips = 0
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_round_trip(conn, cursor, statement, parameters, context, executemany):
+    global _round_trips
+    _round_trips += 1
+
+def build_fixture(tables, rows, rebuild=False):
+    """Create (or reuse) a SQLite database with tables tables of rows rows each"""
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    path = os.path.join(FIXTURE_DIR, f"schema_{tables}_{rows}.db")
+    if os.path.exists(path) and not rebuild:
+        return path
+    if os.path.exists(path):
+        os.remove(path)
+
+    rng = random.Random(tables)
+    conn = sqlite3.connect(path)
+    previous = None
+    for index in range(tables):
+        name = f"{ENTITIES[index % len(ENTITIES)]}_{index // len(ENTITIES)}"
+        parent = f", parent_id INTEGER REFERENCES {previous}(id)" if previous else ", parent_id INTEGER"
+        conn.execute(
+            f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+            f"amount REAL, created_at TEXT{parent})"
+        )
+        conn.executemany(
+            f"INSERT INTO {name} (id, name, amount, created_at, parent_id) VALUES (?, ?, ?, ?, ?)",
+            [
+                (n, f"{name} {n}", round(rng.uniform(0, 1000), 2),
+                 f"{rng.randint(2020, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                 rng.randint(1, rows))
+                for n in range(1, rows + 1)
+            ]
+        )
+        previous = name
+    conn.commit()
+    conn.close()
+    return path
+
+def make_stub_backend(answers, latency, chunk_delay, chunks, prompts):
+    """Return a deterministic LLM backend that records the size of every prompt
+
+    SQL prompts are answered from the scenario; answer prompts with a fixed
+    text streamed in chunks pieces. Each call waits latency seconds before
+    the first token and chunk_delay seconds between chunks.
+    """
+    def backend(model_name, prompt, stream=False, usage=None):
+        kind = "sql" if "Write only the SQL query" in prompt else "answer"
+        prompts.append({"kind": kind, "chars": len(prompt), "tokens": estimate_tokens(prompt)})
+        time.sleep(latency)
+
+        if kind == "sql":
+            question = re.search(r"Your turn:\s*Question: (.*)", prompt).group(1).strip()
+            text = answers[question]
+        else:
+            text = " ".join(f"word{n}" for n in range(chunks * 8))
+        if not stream:
+            return text
+
+        def generate():
+            step = max(1, len(text) // chunks)
+            for start in range(0, len(text), step):
+                time.sleep(chunk_delay)
+                yield text[start:start + step]
+        return generate()
+
+    return backend
+
+def percentiles(values):
+    """p50, p95, mean and max of values (nearest rank)"""
+    if not values:
+        return {"p50": None, "p95": None, "mean": None, "max": None}
+    ordered = sorted(values)
+    rank = lambda p: ordered[min(len(ordered) - 1, max(0, int(round(p * len(ordered))) - 1))]
+    return {"p50": rank(0.50), "p95": rank(0.95), "mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+
+def run_turn(db_id, connection_info, question, rows, use_result_cache):
+    """Run one question through the turn stages and return (timings, round trips, answer)"""
+    global _round_trips
+    _round_trips = 0
+    trace = new_trace()
+    timings = trace["stages"]
+    start = time.perf_counter()
+
+    turn = run_stages({
+        "engine": (lambda: get_query_db(db_id, connection_info), []),
+        "schema": (lambda engine: load_schema(db_id, connection_info), ["engine"])
+    }, timings)
+    db, schema = turn["schema"]
+
+    stage_start = time.perf_counter()
+    chat_history = compact_history(rows, {"summary": "", "summarized_through": 0})
+    timings["compact_history"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    relevant_schema = select_schema(schema, question)
+    timings["select_schema"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    stream, sql, result = get_response(
+        question,
+        db,
+        chat_history,
+        schema=relevant_schema["schema"],
+        db_id=db_id if use_result_cache else None,
+        stream=True,
+        trace=trace,
+        guard=get_guard_settings(connection_info)
+    )
+    timings["generate_and_run"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    answer = "".join(stream)
+    timings["answer"] = time.perf_counter() - stage_start
+
+    timings["total"] = time.perf_counter() - start
+    return timings, _round_trips, answer
+
+def run_fixture(tables, args, scenarios):
+    """Run every scenario against one fixture size and summarize the measurements"""
+    path = build_fixture(tables, args.rows, args.rebuild)
+    db_id = f"bench-{tables}"
+    connection_info = {"db_type": "SQLite", "path": path, "read_only": True}
+
+    prompts = []
+    answers = {q["question"]: q["sql"] for scenario in scenarios for q in scenario["questions"]}
+    set_backend(make_stub_backend(answers, args.latency, args.chunk_delay, args.chunks, prompts))
+
+    if args.tracemalloc:
+        tracemalloc.reset_peak()
+
+    samples = {stage: [] for stage in STAGES}
+    round_trips = []
+    cold_turn = None
+    message_id = 0
+    for _ in range(args.repeat):
+        for scenario in scenarios:
+            # Each pass of a scenario is one chat; its history grows turn by turn
+            rows = []
+            for entry in scenario["questions"]:
+                timings, trips, answer = run_turn(db_id, connection_info, entry["question"], rows, args.result_cache)
+                if cold_turn is None:
+                    cold_turn = {"seconds": timings["total"], "round_trips": trips}
+                else:
+                    for stage in STAGES:
+                        samples[stage].append(timings.get(stage, 0.0))
+                    round_trips.append(trips)
+
+                message_id += 2
+                rows.append({"message_id": message_id - 1, "is_system": False, "content": entry["question"]})
+                rows.append({"message_id": message_id, "is_system": True, "content": answer})
+
+    summary = {
+        "tables": tables,
+        "rows_per_table": args.rows,
+        "turns": len(round_trips) + 1,
+        "cold_turn": cold_turn,
+        "stages": {stage: percentiles(values) for stage, values in samples.items()},
+        "round_trips": percentiles(round_trips),
+        "prompt_tokens": {
+            kind: percentiles([p["tokens"] for p in prompts if p["kind"] == kind])
+            for kind in ("sql", "answer")
+        },
+        "memory": {"rss_high_water_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    }
+    if args.tracemalloc:
+        summary["memory"]["python_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(results):
+    for summary in results["fixtures"]:
+        print(f"\n== {summary['tables']} tables, {summary['rows_per_table']} rows each, {summary['turns']} turns ==")
+        print(f"cold turn: {summary['cold_turn']['seconds'] * 1000:.1f} ms, {summary['cold_turn']['round_trips']} round trips")
+        for stage, stats in summary["stages"].items():
+            print(f"{stage:<18} p50={stats['p50'] * 1000:8.1f} ms  p95={stats['p95'] * 1000:8.1f} ms")
+        trips = summary["round_trips"]
+        print(f"{'round trips':<18} p50={trips['p50']:8}     p95={trips['p95']:8}")
+        for kind, stats in summary["prompt_tokens"].items():
+            print(f"{kind + ' prompt':<18} p50={stats['p50']:8} tok p95={stats['p95']:8} tok")
+        print(f"{'memory':<18} " + ", ".join(f"{key}={value}" for key, value in summary["memory"].items()))
+
+def print_comparison(results, baseline):
+    """Print how p50/p95 of every stage moved against a previous result file"""
+    print(f"\n== compared with {baseline.get('commit')} ==")
+    previous = {summary["tables"]: summary for summary in baseline["fixtures"]}
+    for summary in results["fixtures"]:
+        old = previous.get(summary["tables"])
+        if old is None:
+            continue
+        for stage, stats in summary["stages"].items():
+            before = old["stages"].get(stage)
+            if not before or not before["p50"]:
+                continue
+            changes = [
+                f"{key} {(stats[key] - before[key]) / before[key]:+.0%}"
+                for key in ("p50", "p95") if before[key]
+            ]
+            print(f"{summary['tables']:>5} tables {stage:<18} " + ", ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat turn pipeline offline")
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rows", type=int, default=100, help="rows per fixture table")
+    parser.add_argument("--scenarios", nargs="+", default=sorted(glob.glob(os.path.join(BENCH_DIR, "scenarios", "*.json"))))
+    parser.add_argument("--repeat", type=int, default=3, help="passes over every scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub LLM seconds before the first token")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="stub LLM seconds between streamed chunks")
+    parser.add_argument("--chunks", type=int, default=20, help="chunks per streamed answer")
+    parser.add_argument("--result-cache", action="store_true", help="let repeated queries hit the result cache")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slows every stage)")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the fixture databases")
+    parser.add_argument("--output", help="result file (default benchmarks/results/turn_pipeline_<commit>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    args = parser.parse_args()
+
+    scenarios = []
+    for path in args.scenarios:
+        with open(path) as f:
+            scenarios.append(json.load(f))
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+        "fixtures": [run_fixture(tables, args, scenarios) for tables in args.tables]
+    }
+    set_backend(None)
+
+    print_summary(results)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"turn_pipeline_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nResults written to {output}")
+
+if __name__ == "__main__":
+    main()
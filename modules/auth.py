@@ -2,11 +2,32 @@
 
 import streamlit as st
 import hashlib
+import logging
+import os
+import threading
+import time
 import uuid
 import datetime
-from modules.db_utils import get_db_connection
+from modules.cache_utils import LRUCache
+from modules.db_utils import db_cursor
 from modules.nav import set_query_params
 
+# Expired sessions are deleted every SESSION_SWEEP_INTERVAL seconds, SESSION_SWEEP_BATCH rows per statement
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "3600"))
+SESSION_SWEEP_BATCH = int(os.getenv("SESSION_SWEEP_BATCH", "1000"))
+
+logger = logging.getLogger(__name__)
+
+# Validated session tokens are trusted for this long without asking the database
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "300"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+
+# token -> {"user_id", "username"}, shared by all sessions of this process
+_session_cache = LRUCache(max_entries=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+
+# Tokens ended in this process; kept as long as a cached validation could outlive them
+_revoked_tokens = LRUCache(max_entries=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+
 def initialize_auth_state():
     """Initialize authentication-related session state variables"""
     if "is_authenticated" not in st.session_state:
@@ -38,37 +59,24 @@ def generate_session_token():
 
 def save_session(user_id, username, session_token):
     """Save session information to database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Set expiration time (e.g., 30 days from now)
     expiry = datetime.datetime.now() + datetime.timedelta(days=30)
     expiry_str = expiry.strftime('%Y-%m-%d %H:%M:%S')
     
-    # Check if a session exists for this user
-    cursor.execute(
-        "SELECT id FROM sessions WHERE user_id = %s",
-        (user_id,)
-    )
-    session = cursor.fetchone()
+    # The user's previous token stops being valid
+    _session_cache.discard_where(lambda token, info: info['user_id'] == user_id)
+    _revoked_tokens.discard(session_token)
     
-    if session:
-        # Update existing session
-        cursor.execute(
-            "UPDATE sessions SET token = %s, expires_at = %s WHERE user_id = %s",
-            (session_token, expiry_str, user_id)
-        )
-    else:
-        # Create new session
+    with db_cursor(commit=True) as cursor:
+        # Replace the user's session, or create it
         cursor.execute(
-            "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
+            """
+            INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE token = VALUES(token), expires_at = VALUES(expires_at)
+            """,
             (user_id, session_token, expiry_str)
         )
     
-    conn.commit()
-    cursor.close()
-    conn.close()
-    
     # Store in session state
     st.session_state.session_token = session_token
     st.session_state.is_authenticated = True
@@ -77,35 +85,45 @@ def save_session(user_id, username, session_token):
 
 def validate_session(session_token):
     """Validate a session token and return user information if valid"""
-    if not session_token:
+    if not session_token or _revoked_tokens.get(session_token):
         return None
-        
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    # Get session information
-    cursor.execute(
-        """
-        SELECT s.*, u.username
-        FROM sessions s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.token = %s AND s.expires_at > NOW()
-        """,
-        (session_token,)
-    )
     
-    session = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    cached = _session_cache.get(session_token)
+    if cached:
+        return cached
+        
+    with db_cursor(dictionary=True) as cursor:
+        # Get session information
+        cursor.execute(
+            """
+            SELECT s.user_id, s.expires_at, u.username
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.token = %s AND s.expires_at > NOW()
+            """,
+            (session_token,)
+        )
+        
+        session = cursor.fetchone()
     
     if session:
-        return {
+        session_info = {
             'user_id': session['user_id'],
             'username': session['username']
         }
+        
+        # Never trust the cached entry past the session's own expiry
+        remaining = (session['expires_at'] - datetime.datetime.now()).total_seconds()
+        if not _revoked_tokens.get(session_token):
+            _session_cache.set(session_token, session_info, ttl=max(0, min(SESSION_CACHE_TTL, remaining)))
+        return session_info
     
     return None
 
+def get_session_cache_stats():
+    """Get hit/miss statistics of the validated-session cache"""
+    return _session_cache.stats()
+
 def validate_and_restore_session(token):
     """Validate token and restore session if valid"""
     session_info = validate_session(token)
@@ -115,14 +133,8 @@ def validate_and_restore_session(token):
         st.session_state.username = session_info['username']
         st.session_state.session_token = token
         
-        # Get user's chats
-        from modules.chat import get_user_chats, create_new_chat
-        chats = get_user_chats(session_info['user_id'])
-        if chats:
-            st.session_state.current_chat_id = chats[0]['chat_id']
-        else:
-            # Create a new chat if none exists
-            st.session_state.current_chat_id = create_new_chat(session_info['user_id'])
+        # The chat page opens the latest chat from the list it loads anyway
+        st.session_state.current_chat_id = None
         
         # Set the page to chat if coming from login/register
         if st.session_state.page in ["login", "register"]:
@@ -151,17 +163,14 @@ def check_authentication():
 
 def end_session(session_token):
     """End a session by removing it from the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    _revoked_tokens.set(session_token, True)
+    _session_cache.discard(session_token)
     
-    cursor.execute(
-        "DELETE FROM sessions WHERE token = %s",
-        (session_token,)
-    )
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "DELETE FROM sessions WHERE token = %s",
+            (session_token,)
+        )
     
     # Clear session state
     st.session_state.session_token = None
@@ -169,23 +178,63 @@ def end_session(session_token):
     st.session_state.user_id = None
     st.session_state.username = None
 
+def purge_expired_sessions(batch_size=SESSION_SWEEP_BATCH):
+    """Delete expired sessions batch_size rows at a time and return how many were deleted"""
+    deleted = 0
+    while True:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute(
+                "DELETE FROM sessions WHERE expires_at <= NOW() ORDER BY expires_at LIMIT %s",
+                (batch_size,)
+            )
+            count = cursor.rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+_sweeper_stats = {"passes": 0, "last_deleted": 0, "total_deleted": 0, "last_run": None}
+
+def _run_sweeper(interval, batch_size):
+    while True:
+        try:
+            deleted = purge_expired_sessions(batch_size)
+            _sweeper_stats["passes"] += 1
+            _sweeper_stats["last_deleted"] = deleted
+            _sweeper_stats["total_deleted"] += deleted
+            _sweeper_stats["last_run"] = datetime.datetime.now()
+            logger.info("Session sweep deleted %d expired sessions", deleted)
+        except Exception:
+            logger.exception("Session sweep failed")
+        time.sleep(interval)
+
+def start_session_sweeper(interval=SESSION_SWEEP_INTERVAL, batch_size=SESSION_SWEEP_BATCH):
+    """Start the background thread that purges expired sessions (once per process)"""
+    global _sweeper
+    if interval <= 0:
+        return
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(
+                target=_run_sweeper, args=(interval, batch_size), name="lang2sql-session-sweeper", daemon=True
+            )
+            _sweeper.start()
+
+def get_session_sweeper_stats():
+    """Get how many expired sessions the sweeper has deleted"""
+    return dict(_sweeper_stats)
+
 def register_user(username, password, email):
     """Register a new user"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         hashed_password = hash_password(password)
-        cursor.execute(
-            "INSERT INTO users (username, password, email) VALUES (%s, %s, %s)",
-            (username, hashed_password, email)
-        )
-        
-        conn.commit()
-        user_id = cursor.lastrowid
-        
-        cursor.close()
-        conn.close()
+        with db_cursor(commit=True) as cursor:
+            cursor.execute(
+                "INSERT INTO users (username, password, email) VALUES (%s, %s, %s)",
+                (username, hashed_password, email)
+            )
+            user_id = cursor.lastrowid
         
         return user_id
     except Exception as err:
@@ -195,23 +244,17 @@ def register_user(username, password, email):
 
 def authenticate_user(username, password):
     """Authenticate a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute(
-        "SELECT * FROM users WHERE username = %s",
-        (username,)
-    )
-    
-    user = cursor.fetchone()
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            "SELECT * FROM users WHERE username = %s",
+            (username,)
+        )
+        
+        user = cursor.fetchone()
     
     if user and verify_password(user['password'], password):
-        cursor.close()
-        conn.close()
         return user
     
-    cursor.close()
-    conn.close()
     return None
 
 def handle_login(username, password):
@@ -223,13 +266,8 @@ def handle_login(username, password):
             session_token = generate_session_token()
             save_session(user['id'], user['username'], session_token)
             
-            # Get or create chat
-            from modules.chat import get_user_chats, create_new_chat
-            chats = get_user_chats(user['id'])
-            if chats:
-                st.session_state.current_chat_id = chats[0]['chat_id']
-            else:
-                st.session_state.current_chat_id = create_new_chat(user['id'])
+            # The chat page opens the latest chat, or creates one
+            st.session_state.current_chat_id = None
             
             # Update URL with token
             set_query_params(page="chat", token=session_token)
@@ -0,0 +1,167 @@
+# mod/cache_utils.py - Small in-process caches shared by the app modules
+
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """Thread-safe LRU cache with optional expiry and an eviction callback
+
+    ttl expires entries a fixed time after they were stored (set() can
+    override it per entry), idle_ttl expires entries that have not been
+    read for that long. With max_bytes, sizeof(value) is charged for every
+    entry and the least recently used ones are evicted to stay under it.
+    on_evict is called with (key, value) for every entry that leaves the
+    cache, outside of the cache lock.
+    """
+
+    def __init__(self, max_entries=128, ttl=None, idle_ttl=None, on_evict=None,
+                 max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_expired(self, entry, now):
+        if entry["ttl"] is not None and now - entry["stored_at"] > entry["ttl"]:
+            return True
+        if self.idle_ttl is not None and now - entry["used_at"] > self.idle_ttl:
+            return True
+        return False
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry["size"]
+        return entry
+
+    def _notify(self, evicted):
+        if self.on_evict:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss"""
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and self._is_expired(entry, now):
+                self._remove(key)
+                self.evictions += 1
+                evicted.append((key, entry["value"]))
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                value = default
+            else:
+                entry["used_at"] = now
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry["value"]
+        self._notify(evicted)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entries
+
+        Returns False without storing anything if value alone is larger
+        than max_bytes.
+        """
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            if key in self._entries:
+                old = self._remove(key)
+                if old["value"] is not value:
+                    evicted.append((key, old["value"]))
+            self._entries[key] = {
+                "value": value,
+                "size": size,
+                "ttl": ttl if ttl is not None else self.ttl,
+                "stored_at": now,
+                "used_at": now
+            }
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                old_key = next(iter(self._entries))
+                old_entry = self._remove(old_key)
+                self.evictions += 1
+                evicted.append((old_key, old_entry["value"]))
+        self._notify(evicted)
+        return True
+
+    def discard(self, key):
+        """Remove key from the cache if present"""
+        with self._lock:
+            entry = self._remove(key) if key in self._entries else None
+        if entry is not None:
+            self._notify([(key, entry["value"])])
+
+    def discard_where(self, predicate):
+        """Remove every entry for which predicate(key, value) is true"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if predicate(key, entry["value"])]
+            evicted = [(key, self._remove(key)["value"]) for key in keys]
+        self._notify(evicted)
+        return len(evicted)
+
+    def purge_expired(self):
+        """Remove expired entries without waiting for them to be read"""
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            for key in list(self._entries):
+                entry = self._entries[key]
+                if self._is_expired(entry, now):
+                    self._remove(key)
+                    self.evictions += 1
+                    evicted.append((key, entry["value"]))
+        self._notify(evicted)
+        return len(evicted)
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            evicted = [(key, entry["value"]) for key, entry in self._entries.items()]
+            self._entries.clear()
+            self.total_bytes = 0
+        self._notify(evicted)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def items(self):
+        """Return (key, value) pairs without counting a lookup or refreshing them"""
+        with self._lock:
+            return [(key, entry["value"]) for key, entry in self._entries.items()]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return hit/miss counters for the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -1,16 +1,32 @@
 # mod/chat.py - Chat management functions
 
 import streamlit as st
-from modules.db_utils import get_db_connection
-from langchain_core.messages import AIMessage, HumanMessage
-from modules.db import get_db_connection_by_id, init_query_db
-import json
+from modules.db_utils import db_cursor
+from modules.db import get_connection_info, get_db_connection_by_id
+from modules.engine_registry import get_query_db
+from modules.schema_cache import load_schema
+from modules.schema_index import select_schema
+from modules.sql_cache import SQL_CACHE_ENABLED, get_cache_key, get_cached_sql, save_cached_sql
+from modules.result_cache import cache_result, get_cached_result, get_result_ttl, invalidate_results
+from modules.sql_utils import is_read_only, written_tables
+from modules.llm import generate_text, stream_text
+from modules.executor import QUERY_TIMEOUT_MS, execute_query, format_result_for_prompt
+from modules.preflight import get_guard_settings, preflight
+from modules.pipeline import format_timings, run_in_background, run_stages
+from modules.history import compact_history, get_chat_summary, update_chat_summary
+from modules.tracing import new_trace, record_turn, span, token_usage, trace_record
+from modules.persistence import CHAT_TITLE_LENGTH, add_message, add_query, new_turn, submit_turn
+import logging
 import os
-import google.generativeai as genai
+import time
 
-# Initialize Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# Number of messages loaded per page of chat history
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+
+# Number of chats listed per page in the sidebar
+CHAT_LIST_PAGE_SIZE = int(os.getenv("CHAT_LIST_PAGE_SIZE", "20"))
 
 def initialize_chat_state():
     """Initialize chat-related session state variables"""
@@ -22,80 +38,99 @@ def initialize_chat_state():
         
     if "last_query_result" not in st.session_state:
         st.session_state.last_query_result = None
+        
+    if "bypass_sql_cache" not in st.session_state:
+        st.session_state.bypass_sql_cache = False
+        
+    if "last_turn_trace" not in st.session_state:
+        st.session_state.last_turn_trace = None
+        
+    if "pending_query" not in st.session_state:
+        st.session_state.pending_query = None
 
 def create_new_chat(user_id):
     """Create a new chat for the user and return the chat ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "INSERT INTO chat (user_id) VALUES (%s)",
-        (user_id,)
-    )
-    
-    chat_id = cursor.lastrowid
-    
-    # Add welcome message
-    cursor.execute(
-        """
-        INSERT INTO message (chat_id, content, is_system)
-        VALUES (%s, %s, %s)
-        """,
-        (chat_id, "Hello! I am a SQL Assistant. Ask me anything about your database.", True)
-    )
+    welcome_message = "Hello! I am a SQL Assistant. Ask me anything about your database."
     
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_cursor(commit=True) as cursor:
+        # The chat title is its first message
+        cursor.execute(
+            "INSERT INTO chat (user_id, title, last_activity_at) VALUES (%s, %s, NOW())",
+            (user_id, welcome_message[:CHAT_TITLE_LENGTH])
+        )
+        
+        chat_id = cursor.lastrowid
+        
+        # Add welcome message
+        cursor.execute(
+            """
+            INSERT INTO message (chat_id, content, is_system)
+            VALUES (%s, %s, %s)
+            """,
+            (chat_id, welcome_message, True)
+        )
     
     return chat_id
 
-def get_user_chats(user_id):
-    """Get all chats for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute(
-        """
-        SELECT c.chat_id, c.created_at, 
-               (SELECT content FROM message 
-                WHERE chat_id = c.chat_id 
-                ORDER BY timestamp ASC 
-                LIMIT 1) as first_message
-        FROM chat c
-        WHERE c.user_id = %s
-        ORDER BY c.created_at DESC
-        """,
-        (user_id,)
-    )
+def get_user_chats(user_id, limit=None):
+    """Get the chats of a user, newest first, optionally only the first limit of them"""
+    query = """
+        SELECT chat_id, created_at, title, last_activity_at
+        FROM chat
+        WHERE user_id = %s
+        ORDER BY created_at DESC, chat_id DESC
+    """
+    params = [user_id]
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
     
-    chats = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(query, tuple(params))
+        
+        chats = cursor.fetchall()
     
     return chats
 
-def get_chat_messages(chat_id):
-    """Get all messages for a chat"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute(
-        """
-        SELECT * FROM message
-        WHERE chat_id = %s
-        ORDER BY timestamp ASC
-        """,
-        (chat_id,)
-    )
-    
-    messages = cursor.fetchall()
-    cursor.close()
-    conn.close()
+def get_chat_message_rows(chat_id, after_id=None, before_id=None, limit=None):
+    """Get message rows of a chat in message_id order
+
+    after_id returns only messages newer than that message. Otherwise the
+    newest messages (older than before_id, if given) come back, up to limit.
+    """
+    with db_cursor(dictionary=True) as cursor:
+        if after_id is not None:
+            cursor.execute(
+                """
+                SELECT * FROM message
+                WHERE chat_id = %s AND message_id > %s
+                ORDER BY message_id ASC
+                """,
+                (chat_id, after_id)
+            )
+            return cursor.fetchall()
+        
+        query = "SELECT * FROM message WHERE chat_id = %s"
+        params = [chat_id]
+        if before_id is not None:
+            query += " AND message_id < %s"
+            params.append(before_id)
+        query += " ORDER BY message_id DESC"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
     
-    # Convert to langchain message format
+    rows.reverse()
+    return rows
+
+def to_langchain_messages(rows):
+    """Convert message rows to langchain message format"""
+    from langchain_core.messages import AIMessage, HumanMessage
     langchain_messages = []
-    for msg in messages:
+    for msg in rows:
         if msg['is_system']:
             langchain_messages.append(AIMessage(content=msg['content']))
         else:
@@ -103,26 +138,82 @@ def get_chat_messages(chat_id):
     
     return langchain_messages
 
+def get_chat_messages(chat_id):
+    """Get all messages for a chat"""
+    return to_langchain_messages(get_chat_message_rows(chat_id))
+
+def get_message_cache(chat_id):
+    """Get this session's cached messages for a chat, starting over when the chat changes"""
+    cache = st.session_state.get("message_cache")
+    if cache is None or cache["chat_id"] != chat_id:
+        cache = {"chat_id": chat_id, "rows": [], "loaded": False, "has_earlier": False}
+        st.session_state.message_cache = cache
+    return cache
+
+def sync_message_cache(cache):
+    """Bring a message cache up to date, reading only messages it has not seen"""
+    if not cache["loaded"]:
+        # First load: newest page, plus one row to tell whether there is more
+        rows = get_chat_message_rows(cache["chat_id"], limit=CHAT_PAGE_SIZE + 1)
+        cache["has_earlier"] = len(rows) > CHAT_PAGE_SIZE
+        cache["rows"] = rows[-CHAT_PAGE_SIZE:]
+        cache["loaded"] = True
+    else:
+        last_seen = cache["rows"][-1]['message_id'] if cache["rows"] else 0
+        cache["rows"].extend(get_chat_message_rows(cache["chat_id"], after_id=last_seen))
+    return cache["rows"]
+
+def load_earlier_messages(cache):
+    """Prepend the page of messages before the oldest cached one"""
+    if not cache["rows"]:
+        return
+    rows = get_chat_message_rows(
+        cache["chat_id"],
+        before_id=cache["rows"][0]['message_id'],
+        limit=CHAT_PAGE_SIZE + 1
+    )
+    cache["has_earlier"] = len(rows) > CHAT_PAGE_SIZE
+    cache["rows"] = rows[-CHAT_PAGE_SIZE:] + cache["rows"]
+
 def save_message(chat_id, content, is_system=False):
     """Save a message to the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        """
-        INSERT INTO message (chat_id, content, is_system)
-        VALUES (%s, %s, %s)
-        """,
-        (chat_id, content, is_system)
-    )
-    
-    message_id = cursor.lastrowid
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            INSERT INTO message (chat_id, content, is_system)
+            VALUES (%s, %s, %s)
+            """,
+            (chat_id, content, is_system)
+        )
+        
+        message_id = cursor.lastrowid
+        
+        # Keep the chat's title and last activity time current
+        cursor.execute(
+            """
+            UPDATE chat
+            SET last_activity_at = NOW(), title = COALESCE(title, %s)
+            WHERE chat_id = %s
+            """,
+            (content[:CHAT_TITLE_LENGTH], chat_id)
+        )
     
     return message_id
 
+def format_chat_history(chat_history):
+    """Format langchain messages as prompt text; already formatted history is kept as is"""
+    if isinstance(chat_history, str):
+        return chat_history
+    
+    from langchain_core.messages import AIMessage, HumanMessage
+    chat_history_str = ""
+    for message in chat_history:
+        if isinstance(message, AIMessage):
+            chat_history_str += f"AI: {message.content}\n"
+        elif isinstance(message, HumanMessage):
+            chat_history_str += f"Human: {message.content}\n"
+    return chat_history_str
+
 def get_sqlchain(db):
     template = """
     You are a data analyst at a company. You are interacting with a user who is asking you questions about the company's database. You can modify the database (i.e. CREATE, UPDATE, DELETE, DROP) tables if needed.
@@ -163,15 +254,10 @@ def get_sqlchain(db):
     
     def query_gemini(inputs):
         # Format the prompt with the inputs
-        schema = get_schema(None)
+        schema = inputs.get("schema") or get_schema(None)
         
         # Convert chat history to string format
-        chat_history_str = ""
-        for message in inputs["chat_history"]:
-            if isinstance(message, AIMessage):
-                chat_history_str += f"AI: {message.content}\n"
-            elif isinstance(message, HumanMessage):
-                chat_history_str += f"Human: {message.content}\n"
+        chat_history_str = format_chat_history(inputs["chat_history"])
         
         formatted_prompt = template.format(
             schema=schema,
@@ -179,28 +265,84 @@ def get_sqlchain(db):
             question=inputs["question"]
         )
         
-        # Call Gemini directly with GenerativeModel
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(formatted_prompt)
+        # Call Gemini
+        query = generate_text("gemini-2.0-flash", formatted_prompt, usage=inputs.get("usage")).strip()
         
         # Clean the response
-        query = response.text.strip()
         return query.replace("sql", "").replace("```", "").strip()
     
     return query_gemini
 
-def get_response(user_query, db, chat_history):
-    """Generate AI response for database queries"""
+def get_response(user_query, db, chat_history, schema=None, cache_key=None, db_id=None, result_ttl=None, stream=False, trace=None, guard=None, sql=None, confirmed=False):
+    """Generate AI response for database queries
+
+    With stream=True the response is returned as an iterator of text chunks.
+    If trace (see modules.tracing) is given, it receives the duration of
+    every stage, the token counts of both LLM calls and the row count.
+    With guard (see modules.preflight.get_guard_settings) the query's cost
+    is estimated before it runs and the decision is stored in the trace; sql
+    skips generation, e.g. for a query the user confirmed. The returned query
+    is the one generated, without a LIMIT the guard added to its first run.
+    """
     sql_chain = get_sqlchain(db)
     
+    # Describe the schema once and share it between both prompts
+    if schema is None:
+        schema = db.get_table_info()
+    
+    # Reuse SQL generated earlier for the same question and schema
+    query = sql
+    if query is None:
+        with span(trace, "sql_cache"):
+            query = get_cached_sql(cache_key) if cache_key else None
+    from_cache = query is not None
+    
     # Get the SQL query
-    query = sql_chain({"question": user_query, "chat_history": chat_history})
+    if query is None:
+        with span(trace, "generate_sql"):
+            query = sql_chain({
+                "question": user_query,
+                "chat_history": chat_history,
+                "schema": schema,
+                "usage": token_usage(trace, "sql")
+            })
+    
+    # Reuse the result of an identical read-only query on this connection
+    read_only = is_read_only(query)
+    sql_response = get_cached_result(db_id, query) if db_id is not None and read_only else None
+    from_result_cache = sql_response is not None
+    
+    # Estimate the cost of the query before running it; a LIMIT it adds only
+    # applies to this first execution, the returned query is the one to page through
+    run_query = query
+    if sql_response is None and guard is not None:
+        with span(trace, "preflight"):
+            decision = preflight(db, query, guard, confirmed=confirmed)
+        if trace is not None:
+            trace["preflight"] = {key: decision[key] for key in ("action", "estimated_rows")}
+        if decision["action"] in ("reject", "confirm"):
+            return iter([decision["message"]]) if stream else decision["message"], query, decision["message"]
+        run_query = decision["sql"]
     
     # Run the query
-    try:
-        sql_response = db.run(query)
-    except Exception as e:
-        return f"Error executing SQL query: {str(e)}\n\nThe query was: {query}", query, str(e)
+    if sql_response is None:
+        try:
+            with span(trace, "execute_sql"):
+                sql_response = execute_query(db, run_query, timeout_ms=guard["timeout_ms"] if guard else QUERY_TIMEOUT_MS)
+        except Exception as e:
+            error_message = f"Error executing SQL query: {str(e)}\n\nThe query was: {run_query}"
+            return iter([error_message]) if stream else error_message, query, str(e)
+        
+        if db_id is not None:
+            if read_only:
+                cache_result(db_id, query, sql_response, ttl=result_ttl)
+            else:
+                # Writes invalidate every cached result that read the tables they touched
+                invalidate_results(db_id, written_tables(query))
+    
+    # Only cache read-only SQL that ran successfully; a cached write would be replayed without the model
+    if cache_key and not from_cache and read_only:
+        save_cached_sql(cache_key, user_query, query)
     
     # Format the prompt for the response
     template = """
@@ -215,27 +357,46 @@ def get_response(user_query, db, chat_history):
     """
     
     # Convert chat history to string format
-    chat_history_str = ""
-    for message in chat_history:
-        if isinstance(message, AIMessage):
-            chat_history_str += f"AI: {message.content}\n"
-        elif isinstance(message, HumanMessage):
-            chat_history_str += f"Human: {message.content}\n"
+    chat_history_str = format_chat_history(chat_history)
     
     # Format the prompt with all the information
     formatted_prompt = template.format(
-        schema=db.get_table_info(),
+        schema=schema,
         chat_history=chat_history_str,
-        query=query,
+        query=run_query,
         question=user_query,
-        response=sql_response
+        response=format_result_for_prompt(sql_response)
     )
     
-    # Call Gemini directly for the response
-    model = genai.GenerativeModel("gemini-2.0-flash-lite")
-    response = model.generate_content(formatted_prompt)
+    if trace is not None and isinstance(sql_response, dict):
+        trace["row_count"] = sql_response["row_count"]
+        # The server that ran the query (primary or a replica, see modules.routing)
+        trace["routed_to"] = "result cache" if from_result_cache else sql_response.get("routed_to")
+    
+    # Call Gemini for the response
+    usage = token_usage(trace, "answer")
+    if stream:
+        return stream_text("gemini-2.0-flash-lite", formatted_prompt, usage=usage), query, sql_response
     
-    return response.text, query, sql_response
+    response = generate_text("gemini-2.0-flash-lite", formatted_prompt, usage=usage)
+    
+    return response, query, sql_response
+
+def _load_history(message_cache):
+    """Load the chat history rows; the question being answered is not stored yet"""
+    return list(sync_message_cache(message_cache))
+
+def prefetch_turn(db_id, message_cache, timings=None):
+    """Load everything a turn needs before prompting, running independent stages concurrently"""
+    return run_stages({
+        "db_info": (lambda: get_db_connection_by_id(db_id), []),
+        "history": (lambda: _load_history(message_cache), []),
+        "chat_summary": (lambda: get_chat_summary(message_cache["chat_id"]), []),
+        "connection_info": (lambda db_info: get_connection_info(db_info), ["db_info"]),
+        "engine": (lambda connection_info: get_query_db(db_id, connection_info), ["connection_info"]),
+        # Returns (db, schema); db is rebuilt if the schema changed since the engine was cached
+        "schema": (lambda connection_info, engine: load_schema(db_id, connection_info), ["connection_info", "engine"])
+    }, timings)
 
 def handle_chat():
     """Handle user input in chat interface"""
@@ -243,49 +404,125 @@ def handle_chat():
     user_query = st.chat_input("Ask me about your data...", key="user_input")
     
     if user_query is not None and user_query.strip() != "":
-        # Save user message
-        save_message(st.session_state.current_chat_id, user_query, is_system=False)
-        
-        with st.chat_message("user", avatar="👤"):
-            st.markdown(user_query)
+        answer_question(user_query)
+
+def run_confirmed_query():
+    """Run the query the user confirmed after its pre-flight estimate asked them to"""
+    pending = st.session_state.pending_query
+    st.session_state.pending_query = None
+    answer_question(pending["question"], sql=pending["sql"])
+
+def answer_question(user_query, sql=None):
+    """Answer a question in the current chat; sql is a confirmed query to run instead of generating one"""
+    chat_id = st.session_state.current_chat_id
+    db_id = st.session_state.active_db_id
+    trace = new_trace()
+    timings = trace["stages"]
+    turn_start = time.perf_counter()
+    
+    # A new question drops a query still waiting for confirmation
+    st.session_state.pending_query = None
+    
+    # The turn's messages and query are written together once it is done;
+    # a confirmed query answers a question that is already stored
+    turn_writes = new_turn(chat_id)
+    if sql is None:
+        add_message(turn_writes, user_query)
+    
+    try:
+        if sql is None:
+            with st.chat_message("user", avatar="👤"):
+                st.markdown(user_query)
         
         with st.chat_message("assistant", avatar="🤖"):
-            with st.spinner("🤔 Thinking..."):
-                if st.session_state.active_db_id:
-                    # Get database connection info
-                    db_info = get_db_connection_by_id(st.session_state.active_db_id)
-                    connection_info = json.loads(db_info['connection_info'])
-                    
-                    # Initialize database connection
-                    db = init_query_db(connection_info)
-                    
-                    # Get response
-                    response, sql_query, sql_result = get_response(
-                        user_query, 
-                        db, 
-                        get_chat_messages(st.session_state.current_chat_id)
-                    )
+            if db_id:
+                with st.spinner("🤔 Thinking..."):
+                    # Fetch connection details, history, engine and schema concurrently
+                    turn = prefetch_turn(db_id, get_message_cache(chat_id), timings)
+                    db, schema = turn["schema"]
                     
-                    # Save query to database
-                    from modules.query import save_query
-                    save_query(
-                        st.session_state.current_chat_id,
-                        user_query,
-                        sql_query,
-                        sql_result,
-                        st.session_state.active_db_id
-                    )
+                    # Keep the prompt history within its token budget
+                    with span(trace, "compact_history"):
+                        chat_history = compact_history(turn["history"], turn["chat_summary"])
                     
-                    # Display response
-                    st.markdown(response)
+                    # Only send the tables relevant to this question
+                    with span(trace, "select_schema"):
+                        relevant_schema = select_schema(schema, user_query)
                     
-                    # Save AI message
-                    save_message(st.session_state.current_chat_id, response, is_system=True)
+                    # Look up previously generated SQL unless the cache is bypassed
+                    cache_key = None
+                    if SQL_CACHE_ENABLED and not st.session_state.bypass_sql_cache and sql is None:
+                        cache_key = get_cache_key(user_query, db_id, schema["structure"], turn["history"])
                     
-                else:
-                    response = "⚠️ No database selected. Please select a database from the sidebar."
-                    st.markdown(response)
-                    save_message(st.session_state.current_chat_id, response, is_system=True)
-                    
-        # Rerun to refresh chat history
-        st.rerun()
\ No newline at end of file
+                    # Generate and run the SQL
+                    with span(trace, "generate_and_run"):
+                        response_stream, sql_query, sql_result = get_response(
+                            user_query, 
+                            db, 
+                            chat_history,
+                            schema=relevant_schema["schema"],
+                            cache_key=cache_key,
+                            db_id=db_id,
+                            result_ttl=get_result_ttl(turn["connection_info"]),
+                            stream=True,
+                            trace=trace,
+                            guard=get_guard_settings(turn["connection_info"]),
+                            sql=sql,
+                            confirmed=sql is not None
+                        )
+                
+                # Expensive queries wait for the user to confirm them
+                if trace["preflight"] and trace["preflight"]["action"] == "confirm":
+                    st.session_state.pending_query = {
+                        "chat_id": chat_id,
+                        "db_id": db_id,
+                        "question": user_query,
+                        "sql": sql_query,
+                        "estimated_rows": trace["preflight"]["estimated_rows"]
+                    }
+                
+                # Log the executed query before streaming, so a failed answer still records it;
+                # its trace record is filled in once the answer is done
+                query_trace = {}
+                add_query(turn_writes, user_query, sql_query, sql_result, db_id, trace=query_trace)
+                
+                # Display the response as it is generated
+                with span(trace, "answer"):
+                    response = st.write_stream(response_stream)
+                
+                # The query row keeps the trace of the turn up to here
+                timings["total"] = time.perf_counter() - turn_start
+                query_trace.update(trace_record(trace))
+                
+                # Keep the structured rows for the result table under the chat
+                if isinstance(sql_result, dict):
+                    st.session_state.last_query_result = {
+                        "chat_id": chat_id,
+                        "db_id": db_id,
+                        "sql": sql_query,
+                        "pages": [sql_result]
+                    }
+                
+            else:
+                response = "⚠️ No database selected. Please select a database from the sidebar."
+                st.markdown(response)
+            
+            add_message(turn_writes, response, is_system=True)
+    finally:
+        # A failed turn still keeps the user's question
+        turn_saved = submit_turn(turn_writes)
+    
+    # Wait for the write so the rerun shows the stored messages
+    with span(trace, "persist"):
+        turn_saved.result()
+    
+    # Fold turns that left the verbatim window into the rolling summary
+    run_in_background("update_summary", update_chat_summary, chat_id)
+    
+    timings["total"] = time.perf_counter() - turn_start
+    record_turn(trace)
+    st.session_state.last_turn_trace = trace
+    logger.info("Chat turn timings: %s", format_timings(timings))
+                
+    # Rerun to refresh chat history
+    st.rerun()
\ No newline at end of file
@@ -2,77 +2,122 @@
 
 import streamlit as st
 import json
-from modules.db_utils import get_db_connection
-from langchain_community.utilities import SQLDatabase
+from modules.db_utils import db_cursor
+from modules.dialects import DB_TYPES, DEFAULT_PORTS, create_query_engine
+from modules.executor import QUERY_TIMEOUT_MS
+from modules.preflight import PREFLIGHT_CONFIRM_ROWS, PREFLIGHT_LIMIT_ROWS, PREFLIGHT_REJECT_ROWS
+from modules.routing import ROUTING_POLICIES, attach_router, replica_infos
 
 def get_db_connections():
     """Get all saved database connections"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM database_connection")
-    
-    connections = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM database_connection")
+        
+        connections = cursor.fetchall()
     
     return connections
 
 def get_db_connection_by_id(db_id):
     """Get database connection by ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute(
-        "SELECT * FROM database_connection WHERE db_id = %s",
-        (db_id,)
-    )
-    
-    db_connection = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            "SELECT * FROM database_connection WHERE db_id = %s",
+            (db_id,)
+        )
+        
+        db_connection = cursor.fetchone()
     
     return db_connection
 
 def save_db_connection(db_name, connection_info, db_type):
     """Save database connection information"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        """
-        INSERT INTO database_connection (db_name, connection_info, db_type)
-        VALUES (%s, %s, %s)
-        """,
-        (db_name, json.dumps(connection_info), db_type)
-    )
-    
-    db_id = cursor.lastrowid
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            INSERT INTO database_connection (db_name, connection_info, db_type)
+            VALUES (%s, %s, %s)
+            """,
+            (db_name, json.dumps(connection_info), db_type)
+        )
+        
+        db_id = cursor.lastrowid
     
     return db_id
 
+def get_connection_info(db_info):
+    """Get the connection settings of a saved connection, including its database type"""
+    connection_info = json.loads(db_info['connection_info'])
+    connection_info.setdefault("db_type", db_info['db_type'])
+    return connection_info
+
 def init_query_db(db_connection_info):
     """Initialize the database connection for SQL queries"""
-    db_uri = f"mysql+mysqlconnector://{db_connection_info['user']}:{db_connection_info['password']}@{db_connection_info['host']}:{db_connection_info['port']}/{db_connection_info['database']}"
-    return SQLDatabase.from_uri(db_uri)
+    # LangChain loads a large dependency tree; only pay for it once a database is used
+    from langchain_community.utilities import SQLDatabase
+    
+    # Replica engines are added next to the primary's and created on first use
+    return attach_router(SQLDatabase(create_query_engine(db_connection_info)), db_connection_info)
+
+def _replica_address(line, default_port):
+    """Parse a host[:port] line of the replicas field"""
+    host, _, port = line.rpartition(":") if ":" in line else (line, "", default_port)
+    return {"host": host, "port": port or default_port}
+
+def _connection_form_fields(db_type):
+    """Render the connection fields of db_type and return (connection_info, all required fields filled)"""
+    if db_type == "SQLite":
+        path = st.text_input("Database File Path", placeholder="/data/analytics.db")
+        read_only = st.checkbox("Open read-only", value=True, help="Generated SQL can only read the file")
+        return {"db_type": db_type, "path": path, "read_only": read_only}, bool(path)
+    
+    host = st.text_input("Host", value="localhost")
+    port = st.text_input("Port", value=DEFAULT_PORTS[db_type])
+    user = st.text_input("Username")
+    password = st.text_input("Password", type="password")
+    database = st.text_input("Database Name")
+    
+    # Read replicas share the primary's credentials and database
+    replicas = st.text_area("Read Replicas", placeholder="replica-1.internal:3306\nreplica-2.internal:3306",
+                            help="One host:port per line; generated SELECTs are sent to them")
+    replica_routing = st.selectbox("Replica Routing", ROUTING_POLICIES)
+    connection_info = {
+        "db_type": db_type,
+        "host": host,
+        "port": port,
+        "user": user,
+        "password": password,
+        "database": database
+    }
+    replica_hosts = [line.strip() for line in replicas.splitlines() if line.strip()]
+    if replica_hosts:
+        connection_info["replicas"] = [_replica_address(line, port) for line in replica_hosts]
+        connection_info["replica_routing"] = replica_routing
+    return connection_info, bool(host and port and user and database)
+
+def _guard_form_fields():
+    """Render the pre-flight thresholds and statement timeout of a connection (see modules.preflight)"""
+    with st.expander("Query guard"):
+        st.caption("Estimated rows a generated query may read before it is limited, needs confirmation or is rejected; 0 disables a threshold")
+        return {
+            "preflight_limit_rows": int(st.number_input("Add LIMIT above", min_value=0, value=PREFLIGHT_LIMIT_ROWS, step=10000)),
+            "preflight_confirm_rows": int(st.number_input("Confirm above", min_value=0, value=PREFLIGHT_CONFIRM_ROWS, step=100000)),
+            "preflight_reject_rows": int(st.number_input("Reject above", min_value=0, value=PREFLIGHT_REJECT_ROWS, step=1000000)),
+            "statement_timeout_ms": int(st.number_input("Statement timeout (ms)", min_value=0, value=QUERY_TIMEOUT_MS, step=1000))
+        }
 
 def handle_database_connection():
     """Handle the database connection form"""
     st.markdown("### ➕ Add New Connection")
     
+    # Outside the form so the fields follow the selected type
+    db_type = st.selectbox("Database Type", DB_TYPES)
+    
     with st.form("new_db_connection"):
         db_name = st.text_input("Connection Name")
-        db_type = st.selectbox("Database Type", ["MySQL", "PostgreSQL", "SQLite"])
         
         # Connection parameters
-        host = st.text_input("Host", value="localhost")
-        port = st.text_input("Port", value="3306" if db_type == "MySQL" else "5432")
-        user = st.text_input("Username")
-        password = st.text_input("Password", type="password")
-        database = st.text_input("Database Name")
+        connection_info, complete = _connection_form_fields(db_type)
+        connection_info.update(_guard_form_fields())
         
         # Test and save buttons
         col1, col2 = st.columns(2)
@@ -83,22 +128,19 @@ def handle_database_connection():
         
         # Handle test connection
         if test_button:
-            if db_name and host and port and user and database:
+            if db_name and complete:
                 try:
-                    # Create connection info object
-                    connection_info = {
-                        "host": host,
-                        "port": port,
-                        "user": user,
-                        "password": password,
-                        "database": database
-                    }
-                    
                     # Try to initialize the database
                     with st.spinner("Testing connection..."):
                         db = init_query_db(connection_info)
                         # Try to get table info
                         db.get_table_info()
+                        db._engine.dispose()
+                        # Every replica has to accept the same credentials
+                        for replica_info in replica_infos(connection_info):
+                            replica_engine = create_query_engine(replica_info)
+                            replica_engine.connect().close()
+                            replica_engine.dispose()
                         st.success("✅ Connection successful!")
                 except Exception as e:
                     st.error(f"❌ Connection failed: {str(e)}")
@@ -107,17 +149,8 @@ def handle_database_connection():
         
         # Handle save connection
         if save_button:
-            if db_name and host and port and user and database:
+            if db_name and complete:
                 try:
-                    # Create connection info object
-                    connection_info = {
-                        "host": host,
-                        "port": port,
-                        "user": user,
-                        "password": password,
-                        "database": database
-                    }
-                    
                     # Save connection
                     db_id = save_db_connection(db_name, connection_info, db_type)
                     st.success(f"✅ Connection saved with ID: {db_id}")
@@ -125,4 +158,4 @@ def handle_database_connection():
                 except Exception as e:
                     st.error(f"❌ Failed to save connection: {str(e)}")
             else:
-                st.warning("Please fill in all required fields")
\ No newline at end of file
+                st.warning("Please fill in all required fields")
@@ -1,12 +1,14 @@
 # mod/db_setup.py - Database table creation
 
-from modules.db_utils import get_db_connection
+from modules.db_utils import db_cursor
 
 def create_tables():
     """Create all necessary tables if they don't exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    with db_cursor(commit=True) as cursor:
+        create_base_tables(cursor)
+
+def create_base_tables(cursor):
+    """Run the CREATE TABLE statements on the given cursor"""
     # Create users table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -77,6 +79,39 @@ def create_tables():
     )
     ''')
     
-    conn.commit()
-    cursor.close()
-    conn.close()
\ No newline at end of file
+    # Create generated SQL cache table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sql_cache (
+        cache_key CHAR(64) PRIMARY KEY,
+        question TEXT NOT NULL,
+        generated_sql TEXT NOT NULL,
+        hit_count INT DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_sql_cache_last_used (last_used_at)
+    )
+    ''')
+    
+    # Create rolling chat summary table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_summary (
+        chat_id INT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        summarized_through INT NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chat(chat_id)
+    )
+    ''')
+    
+    # Create compressed query result table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS query_result (
+        query_id INT PRIMARY KEY,
+        format VARCHAR(20) NOT NULL,
+        payload LONGBLOB NOT NULL,
+        row_count INT NOT NULL,
+        byte_size INT NOT NULL,
+        stored_size INT NOT NULL,
+        FOREIGN KEY (query_id) REFERENCES query(query_id)
+    )
+    ''')
@@ -1,19 +1,104 @@
 # modules/db_utils.py
 import os
+import time
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from modules.profiler import profile_connection
 # Only import mysql.connector inside the function
 # to avoid circular imports
 
 # Load environment variables
 load_dotenv()
 
+# Connection pool settings for the lang2sql metadata database
+DB_POOL_NAME = "lang2sql_pool"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_db_config():
+    """Get the connection settings for the lang2sql database"""
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "user": os.getenv("DB_USER", "root"),
+        "password": os.getenv("DB_PASSWORD", ""),
+        "port": os.getenv("DB_PORT", "3306"),
+        "database": os.getenv("DB_NAME", "lang2sql")
+    }
+
+def get_db_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from mysql.connector import pooling  # Import here to avoid circular import
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=DB_POOL_NAME,
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    **get_db_config()
+                )
+    return _pool
+
 def get_db_connection():
-    """Get connection to the lang2sql database"""
-    import mysql.connector  # Import here to avoid circular import
-    return mysql.connector.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        user=os.getenv("DB_USER", "root"),
-        password=os.getenv("DB_PASSWORD", ""),
-        port=os.getenv("DB_PORT", "3306"),
-        database=os.getenv("DB_NAME", "lang2sql")
-    )
\ No newline at end of file
+    """Get a pooled connection to the lang2sql database
+
+    The connection is returned to the pool when closed. If every pooled
+    connection is checked out, wait up to DB_POOL_TIMEOUT seconds for one
+    to be released.
+    """
+    from mysql.connector import errors  # Import here to avoid circular import
+    pool = get_db_pool()
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+    # Health check on checkout: reconnect connections the server has dropped
+    try:
+        conn.ping(reconnect=True, attempts=2, delay=0)
+    except errors.Error:
+        conn.close()
+        raise
+
+    # Statements are recorded while a rerun is being profiled
+    return profile_connection(conn)
+
+@contextmanager
+def db_connection():
+    """Check out a pooled connection and return it to the pool afterwards"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def db_cursor(dictionary=False, commit=False):
+    """Yield a cursor on a pooled connection
+
+    With commit=True the transaction is committed when the block exits
+    normally and rolled back if it raises.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            yield cursor
+            if commit:
+                conn.commit()
+        except Exception:
+            if commit:
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
@@ -0,0 +1,109 @@
+# mod/dialects.py - Engine URIs and tuned defaults per target database type
+
+import os
+
+# MySQL and PostgreSQL engine pools
+QUERY_DB_POOL_SIZE = int(os.getenv("QUERY_DB_POOL_SIZE", "5"))
+QUERY_DB_POOL_RECYCLE = int(os.getenv("QUERY_DB_POOL_RECYCLE", "3600"))
+
+# PostgreSQL: cancel statements running longer than this on the server
+POSTGRES_STATEMENT_TIMEOUT_MS = int(os.getenv("POSTGRES_STATEMENT_TIMEOUT_MS", "30000"))
+
+# SQLite: bytes of the file mapped into memory, and page cache per connection in KiB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+DB_TYPES = ["MySQL", "PostgreSQL", "SQLite"]
+
+DEFAULT_PORTS = {"MySQL": "3306", "PostgreSQL": "5432"}
+
+def get_db_type(connection_info):
+    """Return the database type of a connection; connections saved without one are MySQL"""
+    return connection_info.get("db_type") or "MySQL"
+
+def _server_url(drivername, connection_info):
+    from sqlalchemy.engine import URL
+    return URL.create(
+        drivername,
+        username=connection_info.get("user") or None,
+        password=connection_info.get("password") or None,
+        host=connection_info.get("host") or None,
+        port=int(connection_info["port"]) if connection_info.get("port") else None,
+        database=connection_info.get("database") or None
+    )
+
+def _sqlite_uri(connection_info):
+    """Build a SQLite URI; read-only files are opened with mode=ro so nothing can write to them"""
+    path = os.path.abspath(os.path.expanduser(connection_info["path"]))
+    if connection_info.get("read_only", True):
+        return f"sqlite:///file:{path}?mode=ro&uri=true"
+    return f"sqlite:///{path}"
+
+def build_engine_spec(connection_info):
+    """Return (uri, create_engine keyword arguments) for a connection"""
+    # A full SQLAlchemy URI, as used by the benchmark fixtures
+    if "uri" in connection_info:
+        return connection_info["uri"], {}
+
+    db_type = get_db_type(connection_info)
+    if db_type == "MySQL":
+        return _server_url("mysql+mysqlconnector", connection_info), {
+            "pool_size": QUERY_DB_POOL_SIZE,
+            "pool_recycle": QUERY_DB_POOL_RECYCLE,
+            "pool_pre_ping": True
+        }
+
+    if db_type == "PostgreSQL":
+        return _server_url("postgresql+psycopg2", connection_info), {
+            "pool_size": QUERY_DB_POOL_SIZE,
+            "pool_recycle": QUERY_DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+            "connect_args": {
+                "options": f"-c statement_timeout={POSTGRES_STATEMENT_TIMEOUT_MS}",
+                "application_name": "lang2sql"
+            }
+        }
+
+    if db_type == "SQLite":
+        # Engines are shared by the pipeline threads
+        return _sqlite_uri(connection_info), {"connect_args": {"check_same_thread": False}}
+
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+def _sqlite_pragmas(read_only):
+    """Return a connect listener applying the SQLite pragmas for a file opened read-only or not"""
+    pragmas = [
+        f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}",
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA temp_store = MEMORY"
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        # WAL lets readers run while a write is in progress
+        pragmas += ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL"]
+
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return apply
+
+def create_query_engine(connection_info):
+    """Create the SQLAlchemy engine for a connection with the defaults of its database type"""
+    from sqlalchemy import create_engine, event
+    uri, engine_args = build_engine_spec(connection_info)
+    engine = create_engine(uri, **engine_args)
+
+    if "uri" in connection_info:
+        return engine
+
+    # Server-side cursors are requested per read-only SELECT by the executor; PostgreSQL
+    # can only DECLARE cursors for SELECT/VALUES, so they cannot be an engine default
+    if get_db_type(connection_info) == "SQLite":
+        event.listen(engine, "connect", _sqlite_pragmas(connection_info.get("read_only", True)))
+
+    return engine
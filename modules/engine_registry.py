@@ -0,0 +1,81 @@
+# mod/engine_registry.py - Long-lived query engines per saved connection
+
+import hashlib
+import json
+import os
+import threading
+from modules.cache_utils import LRUCache
+from modules.db import init_query_db
+from modules.routing import dispose_router
+
+# Registry settings
+ENGINE_REGISTRY_SIZE = int(os.getenv("ENGINE_REGISTRY_SIZE", "16"))
+ENGINE_IDLE_TTL = float(os.getenv("ENGINE_IDLE_TTL", "1800"))
+
+def _dispose(key, db):
+    """Close every pooled connection held by an evicted engine and its replicas"""
+    db._engine.dispose()
+    dispose_router(db)
+
+_registry = LRUCache(
+    max_entries=ENGINE_REGISTRY_SIZE,
+    idle_ttl=ENGINE_IDLE_TTL,
+    on_evict=_dispose
+)
+_fingerprints = {}
+_build_locks = {}
+_lock = threading.Lock()
+
+def connection_fingerprint(connection_info):
+    """Return a stable digest of a connection_info dict"""
+    payload = json.dumps(connection_info, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def get_query_db(db_id, connection_info):
+    """Get the cached SQLDatabase for a saved connection, building it on a miss"""
+    _registry.purge_expired()
+
+    fingerprint = connection_fingerprint(connection_info)
+    key = (db_id, fingerprint)
+    db = _registry.get(key)
+    if db is not None:
+        return db
+
+    # One build per connection at a time: a second engine stored under the same key
+    # would evict, and dispose, the first while another thread is using it
+    with _lock:
+        build_lock = _build_locks.setdefault(db_id, threading.Lock())
+
+    with build_lock:
+        # Built by another thread while this one waited
+        db = get_open_query_db(db_id, fingerprint)
+        if db is not None:
+            return db
+
+        with _lock:
+            # The saved connection changed: drop the engine built for the old settings
+            previous = _fingerprints.get(db_id)
+            if previous is not None and previous != fingerprint:
+                _registry.discard((db_id, previous))
+            _fingerprints[db_id] = fingerprint
+
+        db = init_query_db(connection_info)
+        _registry.set(key, db)
+        return db
+
+def get_open_query_db(db_id, fingerprint=None):
+    """Return the engine already open for db_id (and fingerprint, if given), without building one, or None"""
+    for key, db in _registry.items():
+        if key[0] == db_id and fingerprint in (None, key[1]):
+            return db
+    return None
+
+def invalidate_query_db(db_id):
+    """Dispose the engine cached for db_id so the next use rebuilds it"""
+    with _lock:
+        _fingerprints.pop(db_id, None)
+    _registry.discard_where(lambda key, db: key[0] == db_id)
+
+def get_registry_stats():
+    """Return hit/miss counters for the engine registry"""
+    return _registry.stats()
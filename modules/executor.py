@@ -0,0 +1,278 @@
+# mod/executor.py - Bounded execution of generated SQL against target databases
+
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from modules.routing import PRIMARY, note_write, routed_connection
+from modules.sql_utils import first_keyword, is_read_only, normalize_sql, written_tables
+
+# Result limits
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "1000"))
+RESULT_MAX_BYTES = int(os.getenv("RESULT_MAX_BYTES", str(1024 * 1024)))
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+
+# How much of a result is shown to the summary prompt
+PROMPT_RESULT_ROWS = int(os.getenv("PROMPT_RESULT_ROWS", "50"))
+PROMPT_RESULT_CHARS = int(os.getenv("PROMPT_RESULT_CHARS", "8000"))
+
+# Rows pulled from the server-side cursor per round trip
+FETCH_BATCH_SIZE = 200
+
+# Server-side timeout for generated SQL; connections override it with "statement_timeout_ms"
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "30000"))
+
+# SQLite virtual machine steps between deadline checks
+SQLITE_PROGRESS_STEPS = 10000
+
+# A LIMIT ending a statement: "LIMIT n", "LIMIT n OFFSET m", "LIMIT m, n" or "OFFSET m LIMIT n"
+TRAILING_LIMIT = re.compile(
+    r"\s+(?:limit\s+(?P<count>\d+)(?:\s+offset\s+(?P<offset>\d+)|\s*,\s*(?P<comma_count>\d+))?"
+    r"|offset\s+(?P<leading_offset>\d+)\s+limit\s+(?P<trailing_count>\d+))\s*$",
+    re.IGNORECASE
+)
+
+logger = logging.getLogger(__name__)
+
+def _driver_connection(connection):
+    """Return the DB-API connection under a SQLAlchemy connection"""
+    pooled = connection.connection
+    return getattr(pooled, "driver_connection", None) or pooled.connection
+
+def _set(connection, statement):
+    """Run a SET statement; it can never go through a server-side cursor"""
+    connection.exec_driver_sql(statement, execution_options={"stream_results": False})
+
+@contextmanager
+def statement_timeout(connection, timeout_ms):
+    """Have the server cancel statements run on connection in the with-block after timeout_ms
+
+    MySQL uses MAX_EXECUTION_TIME (SELECT only), PostgreSQL a transaction
+    local statement_timeout, SQLite a progress handler that interrupts the
+    statement once the deadline has passed.
+    """
+    dialect = connection.dialect.name
+    if not timeout_ms or dialect not in ("mysql", "postgresql", "sqlite"):
+        yield
+        return
+
+    if dialect == "postgresql":
+        # Reverted when the transaction ends
+        _set(connection, f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+        yield
+        return
+
+    if dialect == "sqlite":
+        deadline = time.monotonic() + timeout_ms / 1000
+        raw = _driver_connection(connection)
+        raw.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, SQLITE_PROGRESS_STEPS)
+        try:
+            yield
+        finally:
+            raw.set_progress_handler(None, 0)
+        return
+
+    try:
+        _set(connection, f"SET SESSION max_execution_time = {int(timeout_ms)}")
+    except Exception as e:
+        # MariaDB has no max_execution_time; its connect-time settings apply instead
+        logger.debug("max_execution_time not supported: %s", e)
+        yield
+        return
+    try:
+        yield
+    finally:
+        # Pooled connections are reused by other queries
+        _set(connection, "SET SESSION max_execution_time = DEFAULT")
+
+def _collect(result, max_rows, max_bytes):
+    """Read rows from a cursor result until it ends or a limit is reached"""
+    columns = list(result.keys())
+    rows = []
+    size = 0
+    truncated = False
+
+    while not truncated:
+        batch = result.fetchmany(FETCH_BATCH_SIZE)
+        if not batch:
+            break
+        for row in batch:
+            row_size = len(repr(tuple(row)))
+            if len(rows) >= max_rows or size + row_size > max_bytes:
+                truncated = True
+                break
+            rows.append(list(row))
+            size += row_size
+
+    return {
+        "columns": columns,
+        "rows": rows,
+        "row_count": len(rows),
+        "truncated": truncated,
+        "bytes": size
+    }
+
+def split_limit(sql):
+    """Split the LIMIT off the end of sql, returning (statement, row count or None, offset)"""
+    sql = normalize_sql(sql)
+    match = TRAILING_LIMIT.search(sql)
+    if not match:
+        return sql, None, 0
+    if match.group("comma_count"):
+        # MySQL's LIMIT offset, count
+        count, offset = match.group("comma_count"), match.group("count")
+    elif match.group("trailing_count"):
+        count, offset = match.group("trailing_count"), match.group("leading_offset")
+    else:
+        count, offset = match.group("count"), match.group("offset")
+    return sql[:match.start()], int(count), int(offset or 0)
+
+def limit_sql(sql, max_rows, offset=0):
+    """Bound sql to max_rows rows, skipping the first offset rows of its result
+
+    The LIMIT is appended to the statement, or its own LIMIT is narrowed,
+    rather than wrapping it in a subquery: MySQL rejects derived tables with
+    duplicate column names, which joins like SELECT o.id, c.id produce.
+    """
+    statement, count, own_offset = split_limit(sql)
+    if count is not None:
+        max_rows = min(max_rows, max(count - offset, 0))
+    offset += own_offset
+
+    bounded = f"{statement} LIMIT {int(max_rows)}"
+    return f"{bounded} OFFSET {int(offset)}" if offset else bounded
+
+def _needs_server_limit(engine, sql):
+    """Check whether the driver would buffer the whole result of sql before the first fetch
+
+    mysql-connector has no server-side cursors and SQLAlchemy opens it
+    buffered, so for MySQL the row cap has to be part of the statement.
+    """
+    return engine.dialect.name == "mysql" and not engine.dialect.supports_server_side_cursors and is_pageable(sql)
+
+def execute_query(db, sql, max_rows=RESULT_MAX_ROWS, max_bytes=RESULT_MAX_BYTES, timeout_ms=QUERY_TIMEOUT_MS):
+    """Run sql on db and return a bounded, structured result
+
+    Read-only statements stream through a server-side cursor and stop
+    after max_rows rows or max_bytes of row data; truncated is set when
+    rows were left unread. Other statements run in a transaction and
+    report the number of affected rows. The server cancels statements
+    running longer than timeout_ms. Read-only statements run on a replica
+    when the connection has any (see modules.routing); routed_to names the
+    server that ran the statement.
+    """
+    # SQLAlchemy is already loaded by the time an engine exists
+    from sqlalchemy import text
+    engine = db._engine
+
+    if is_read_only(sql):
+        # One row past the cap tells whether the result was truncated
+        bounded_sql = limit_sql(sql, max_rows + 1) if _needs_server_limit(engine, sql) else sql
+        with routed_connection(db, sql) as (connection, routed_to), statement_timeout(connection, timeout_ms):
+            # Options on the statement only, so later statements on the connection are not streamed;
+            # server-side cursors (DECLARE CURSOR on PostgreSQL) only take SELECT and VALUES,
+            # so SHOW, EXPLAIN and DESCRIBE are read in one go
+            statement = text(bounded_sql).execution_options(stream_results=is_pageable(sql), max_row_buffer=FETCH_BATCH_SIZE * 5)
+            result = connection.execute(statement)
+            return dict(_collect(result, max_rows, max_bytes), routed_to=routed_to)
+
+    # Writes and DDL always run on the primary
+    with engine.begin() as connection, statement_timeout(connection, timeout_ms):
+        result = connection.execute(text(sql))
+        if result.returns_rows:
+            written = dict(_collect(result, max_rows, max_bytes), routed_to=PRIMARY)
+        else:
+            written = {
+                "columns": [],
+                "rows": [],
+                "row_count": 0,
+                "rows_affected": result.rowcount,
+                "truncated": False,
+                "bytes": 0,
+                "routed_to": PRIMARY
+            }
+
+    # Once committed, reads of the written tables stay on the primary until the replicas catch up
+    note_write(db, written_tables(sql))
+    return written
+
+def format_result_for_prompt(result, max_rows=PROMPT_RESULT_ROWS, max_chars=PROMPT_RESULT_CHARS):
+    """Render a structured result as compact text for the summary prompt"""
+    if not isinstance(result, dict):
+        return str(result)
+
+    if not result["columns"]:
+        return f"{result.get('rows_affected', 0)} rows affected"
+
+    lines = ["Columns: " + ", ".join(result["columns"])]
+    length = len(lines[0])
+    shown = 0
+    for row in result["rows"][:max_rows]:
+        line = repr(tuple(row))
+        if length + len(line) > max_chars:
+            break
+        lines.append(line)
+        length += len(line) + 1
+        shown += 1
+
+    if shown < result["row_count"] or result["truncated"]:
+        total = f"at least {result['row_count'] + 1}" if result["truncated"] else str(result["row_count"])
+        lines.append(f"[truncated: showing {shown} of {total} rows]")
+
+    return "\n".join(lines)
+
+def is_pageable(sql):
+    """Check whether further pages of sql can be fetched by adding a LIMIT to it"""
+    return is_read_only(sql) and first_keyword(sql) in ("select", "with")
+
+def _keyset_column(result):
+    """Return the first column if its values strictly increase, so it can be used as a keyset"""
+    if not result["columns"] or not result["rows"]:
+        return None
+    values = [row[0] for row in result["rows"]]
+    try:
+        if all(value is not None for value in values) and all(a < b for a, b in zip(values, values[1:])):
+            return result["columns"][0]
+    except TypeError:
+        pass
+    return None
+
+def _wrappable(columns):
+    """Check whether a result with these columns can be selected from as a subquery on any dialect
+
+    MySQL rejects derived tables with duplicate column names and
+    auto-generated names longer than 64 characters.
+    """
+    names = [column.lower() for column in columns]
+    return len(set(names)) == len(names) and all(len(name) <= 64 for name in names)
+
+def fetch_next_page(db, sql, previous, page_size=RESULT_PAGE_SIZE, timeout_ms=QUERY_TIMEOUT_MS):
+    """Fetch the page of rows following previous, a result of the same statement
+
+    When the first column of the previous page is strictly increasing and
+    the result can be wrapped in a subquery, the next page is read with a
+    keyset (WHERE first_column > last value), otherwise with LIMIT/OFFSET
+    added to the statement itself.
+    """
+    from sqlalchemy import text
+    keyset = previous.get("keyset", _keyset_column(previous) if _wrappable(previous["columns"]) else None)
+    offset = previous.get("offset", 0) + previous["row_count"]
+
+    if keyset:
+        column = db._engine.dialect.identifier_preparer.quote(keyset)
+        page_sql = f"SELECT * FROM ({normalize_sql(sql)}) AS page_source WHERE {column} > :last_key ORDER BY {column} LIMIT :page_size"
+        params = {"last_key": previous["rows"][-1][0], "page_size": page_size + 1}
+    else:
+        page_sql = limit_sql(sql, page_size + 1, offset)
+        params = {}
+
+    with routed_connection(db, page_sql) as (connection, routed_to), statement_timeout(connection, timeout_ms):
+        result = connection.execute(text(page_sql), params)
+        page = _collect(result, page_size, RESULT_MAX_BYTES)
+
+    page["routed_to"] = routed_to
+
+    page["keyset"] = keyset
+    page["offset"] = offset
+    return page
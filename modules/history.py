@@ -0,0 +1,145 @@
+# mod/history.py - Token-budgeted conversation history for prompts
+
+import os
+import re
+from modules.db_utils import db_cursor
+from modules.llm import estimate_tokens, generate_text
+
+# Compaction settings
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "3"))
+HISTORY_MESSAGE_CHARS = int(os.getenv("HISTORY_MESSAGE_CHARS", "800"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "400"))
+
+# Most text sent to the summarizer in one update
+SUMMARY_INPUT_TOKENS = 4000
+SUMMARY_MODEL = "gemini-2.0-flash-lite"
+
+SUMMARY_TEMPLATE = """
+You maintain a running summary of a conversation between a user and a SQL assistant.
+Update the summary below with the new turns. Keep the user's goals, the tables,
+filters and definitions they referred to, and conclusions reached. Leave out
+raw query results. Answer with the updated summary only, in at most {max_words} words.
+
+Current summary: {summary}
+
+New turns:
+{turns}
+"""
+
+def strip_payloads(content, max_chars=HISTORY_MESSAGE_CHARS):
+    """Drop bulky payloads such as code blocks and result tables from a message"""
+    content = re.sub(r"```.*?```", "[code omitted]", content, flags=re.DOTALL)
+    content = re.sub(r"(?m)^\s*\|.*\|\s*$\n?", "", content)
+    content = re.sub(r"\s+", " ", content).strip()
+    if len(content) > max_chars:
+        content = content[:max_chars].rstrip() + " …"
+    return content
+
+def format_message(row):
+    """Format a message row as a line of conversation"""
+    speaker = "AI" if row['is_system'] else "Human"
+    return f"{speaker}: {strip_payloads(row['content'])}"
+
+def split_turns(rows):
+    """Group message rows into turns, each starting with a user message"""
+    turns = []
+    for row in rows:
+        if not row['is_system'] or not turns:
+            turns.append([])
+        turns[-1].append(row)
+    return turns
+
+def get_chat_summary(chat_id):
+    """Get the stored rolling summary of a chat"""
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            "SELECT summary, summarized_through FROM chat_summary WHERE chat_id = %s",
+            (chat_id,)
+        )
+        row = cursor.fetchone()
+
+    return row or {"summary": "", "summarized_through": 0}
+
+def save_chat_summary(chat_id, summary, summarized_through):
+    """Store the rolling summary of a chat"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            INSERT INTO chat_summary (chat_id, summary, summarized_through)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                summary = VALUES(summary),
+                summarized_through = VALUES(summarized_through)
+            """,
+            (chat_id, summary, summarized_through)
+        )
+
+def compact_history(rows, summary, token_budget=HISTORY_TOKEN_BUDGET):
+    """Build a conversation history string that fits in token_budget
+
+    The last HISTORY_RECENT_TURNS turns are kept (with bulky payloads
+    removed), older turns are represented by the stored rolling summary.
+    Older turns the summary has not caught up with yet fill whatever
+    budget is left, newest first.
+    """
+    turns = split_turns(rows)
+    recent = turns[-HISTORY_RECENT_TURNS:] if HISTORY_RECENT_TURNS else []
+    older = turns[:len(turns) - len(recent)]
+
+    summary_text = ""
+    if summary["summary"]:
+        summary_text = f"Summary of earlier conversation: {strip_payloads(summary['summary'], HISTORY_SUMMARY_TOKENS * 4)}"
+    remaining = token_budget - estimate_tokens(summary_text)
+
+    # Newest turns first so the budget is spent where it matters most
+    kept = []
+    pending = [turn for turn in older if turn[-1]['message_id'] > summary["summarized_through"]]
+    for index, turn in enumerate(reversed(pending + recent)):
+        text = "\n".join(format_message(row) for row in turn)
+        tokens = estimate_tokens(text)
+        if tokens > remaining and index > 0:
+            break
+        kept.append(text)
+        remaining -= tokens
+
+    lines = [summary_text] if summary_text else []
+    lines.extend(reversed(kept))
+    return "\n".join(lines) + ("\n" if lines else "")
+
+def update_chat_summary(chat_id):
+    """Fold turns that left the verbatim window into the chat's rolling summary"""
+    from modules.chat import get_chat_message_rows
+    summary = get_chat_summary(chat_id)
+    rows = get_chat_message_rows(chat_id, after_id=summary["summarized_through"])
+
+    turns = split_turns(rows)
+    older = turns[:-HISTORY_RECENT_TURNS] if HISTORY_RECENT_TURNS else turns
+    if not older:
+        return summary
+
+    # Fold a long backlog in several passes of at most SUMMARY_INPUT_TOKENS each, oldest first
+    rows = [row for turn in older for row in turn]
+    while rows:
+        text = ""
+        count = 0
+        for row in rows:
+            line = format_message(row)
+            if count and estimate_tokens(text) + estimate_tokens(line) > SUMMARY_INPUT_TOKENS:
+                break
+            text += line + "\n"
+            count += 1
+
+        prompt = SUMMARY_TEMPLATE.format(
+            max_words=HISTORY_SUMMARY_TOKENS * 3 // 4,
+            summary=summary["summary"] or "(none yet)",
+            turns=text
+        )
+        new_summary = generate_text(SUMMARY_MODEL, prompt).strip()
+
+        # Only advance past the messages this pass actually summarized
+        summary = {"summary": new_summary, "summarized_through": rows[count - 1]['message_id']}
+        save_chat_summary(chat_id, summary["summary"], summary["summarized_through"])
+        rows = rows[count:]
+
+    return summary
@@ -0,0 +1,306 @@
+# mod/ingest.py - Chunked import of CSV and Excel files into local SQLite databases
+
+import os
+import re
+import sqlite3
+import uuid
+import warnings
+from modules.db import save_db_connection
+
+# Where imported databases are created
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data/uploads")
+
+# Directory files can be imported from by path on the server; unset disables path imports
+IMPORT_DIR = os.getenv("IMPORT_DIR")
+
+# Rows parsed, typed and inserted at a time
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+
+# Most key columns indexed per table
+MAX_KEY_INDEXES = 5
+
+KEY_NAME = re.compile(r"(^id$|_id$|^key$|_key$)")
+
+# Whole numbers, parsed exactly rather than through floats
+INTEGER_TEXT = r"[+-]?\d+"
+
+# Numbers written with leading zeros (zip codes, codes) are identifiers, kept as text
+LEADING_ZERO = r"^[+-]?0\d"
+
+# Only columns whose values all start like a date are parsed as dates
+DATE_LIKE = r"^\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}"
+
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx", ".xls")
+
+def sanitize_name(name, fallback):
+    """Turn a header or sheet name into a plain SQL identifier"""
+    name = re.sub(r"[^0-9a-zA-Z]+", "_", str(name or "")).strip("_").lower()
+    if not name:
+        name = fallback
+    if name[0].isdigit():
+        name = f"c_{name}"
+    return name
+
+def resolve_import_path(path):
+    """Resolve a server-side path, relative to IMPORT_DIR, refusing anything outside it"""
+    if not IMPORT_DIR:
+        raise ValueError("Importing files by path is disabled (IMPORT_DIR is not set)")
+
+    root = os.path.realpath(IMPORT_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"{path} is outside the import directory")
+    return resolved
+
+def _column_names(header):
+    """Sanitize header cells, numbering empty and repeated names"""
+    names = []
+    for index, cell in enumerate(header):
+        name = sanitize_name(cell, f"column_{index + 1}")
+        candidate, suffix = name, 2
+        while candidate in names:
+            candidate = f"{name}_{suffix}"
+            suffix += 1
+        names.append(candidate)
+    return names
+
+def _as_text(chunk):
+    """Represent every cell as stripped text, with empty cells as None"""
+    for column in chunk.columns:
+        values = chunk[column]
+        text = values.astype(str).str.strip()
+        chunk[column] = text.where(values.notna() & (text != ""), None)
+    return chunk
+
+def _parse_dates(values):
+    """Parse text values as dates, with NaT where they are not"""
+    import pandas as pd
+
+    # pandas warns when it falls back to parsing values one by one
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return pd.to_datetime(values, errors="coerce")
+
+def _to_int64(text):
+    value = int(text)
+    return value if -2 ** 63 <= value < 2 ** 63 else None
+
+def _parse_integers(values):
+    """Parse whole-number text exactly as Python ints; anything else, or outside 64 bits, becomes None"""
+    import pandas as pd
+
+    whole = values.str.fullmatch(INTEGER_TEXT, na=False)
+    # Built as an object Series so pandas does not turn the ints into floats next to the Nones
+    return pd.Series(
+        [_to_int64(value) if is_whole else None for value, is_whole in zip(values, whole)],
+        index=values.index, dtype=object
+    )
+
+def infer_types(chunk):
+    """Infer a SQLite column type per column from a chunk of text values, one vectorized pass per column"""
+    import pandas as pd
+
+    types = {}
+    for column in chunk.columns:
+        values = chunk[column].dropna()
+        if values.empty:
+            types[column] = "TEXT"
+            continue
+
+        if values.str.fullmatch(INTEGER_TEXT).all():
+            # Integers past 64 bits would lose digits as REAL, so they stay text
+            fits = _parse_integers(values).notna().all()
+            types[column] = "INTEGER" if fits and not values.str.match(LEADING_ZERO).any() else "TEXT"
+            continue
+
+        numbers = pd.to_numeric(values, errors="coerce")
+        if numbers.notna().all() and not values.str.match(LEADING_ZERO).any():
+            types[column] = "REAL"
+            continue
+
+        if not values.str.match(DATE_LIKE).all():
+            types[column] = "TEXT"
+            continue
+        types[column] = "TIMESTAMP" if _parse_dates(values).notna().all() else "TEXT"
+    return types
+
+def convert_chunk(chunk, types):
+    """Convert text values to their column types; values that do not fit are kept as text"""
+    import pandas as pd
+
+    converted = {}
+    for column, column_type in types.items():
+        values = chunk[column]
+        if column_type == "INTEGER":
+            # Parsed from the text, so integers above 2**53 keep every digit
+            typed = _parse_integers(values)
+        elif column_type == "REAL":
+            typed = pd.to_numeric(values, errors="coerce").astype(object)
+        elif column_type == "TIMESTAMP":
+            typed = _parse_dates(values).dt.strftime("%Y-%m-%d %H:%M:%S").astype(object)
+        else:
+            converted[column] = values
+            continue
+        converted[column] = typed.where(typed.notna(), values)
+    return pd.DataFrame(converted, columns=list(types))
+
+def _iter_csv(source, chunk_rows):
+    import pandas as pd
+
+    reader = pd.read_csv(source, chunksize=chunk_rows, dtype=str, keep_default_na=False, encoding_errors="replace")
+    for chunk in reader:
+        chunk.columns = _column_names(chunk.columns)
+        yield _as_text(chunk)
+
+def _rows_to_chunks(rows, chunk_rows):
+    """Group an iterator of row tuples (header first) into text DataFrames"""
+    import pandas as pd
+
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = _column_names(header)
+
+    batch = []
+    for row in rows:
+        row = list(row[:len(columns)]) + [None] * (len(columns) - len(row))
+        if any(value is not None and value != "" for value in row):
+            batch.append(row)
+        if len(batch) >= chunk_rows:
+            yield _as_text(pd.DataFrame(batch, columns=columns, dtype=object))
+            batch = []
+    if batch:
+        yield _as_text(pd.DataFrame(batch, columns=columns, dtype=object))
+
+def _iter_xlsx(source, chunk_rows):
+    """Yield (sheet name, chunks) per worksheet, reading rows as they are parsed"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, _rows_to_chunks(sheet.iter_rows(values_only=True), chunk_rows)
+    finally:
+        workbook.close()
+
+def _iter_xls(source, chunk_rows):
+    """Yield (sheet name, chunks) per sheet of a legacy .xls workbook"""
+    import xlrd
+
+    # The BIFF format cannot be streamed; on_demand at least loads one sheet at a time
+    contents = source.read() if hasattr(source, "read") else None
+    workbook = xlrd.open_workbook(filename=None if contents else source, file_contents=contents, on_demand=True)
+    try:
+        for index in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(index)
+
+            def rows(sheet=sheet):
+                for row_index in range(sheet.nrows):
+                    yield tuple(
+                        xlrd.xldate_as_datetime(cell.value, workbook.datemode) if cell.ctype == xlrd.XL_CELL_DATE else cell.value
+                        for cell in sheet.row(row_index)
+                    )
+
+            yield sheet.name, _rows_to_chunks(rows(), chunk_rows)
+            workbook.unload_sheet(index)
+    finally:
+        workbook.release_resources()
+
+def iter_tables(source, filename, chunk_rows=INGEST_CHUNK_ROWS):
+    """Yield (table name, iterator of text DataFrame chunks) for every table in a file"""
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    extension = extension.lower()
+    if extension == ".csv":
+        yield sanitize_name(stem, "data"), _iter_csv(source, chunk_rows)
+    elif extension == ".xlsx":
+        for sheet, chunks in _iter_xlsx(source, chunk_rows):
+            yield sanitize_name(f"{stem}_{sheet}", "sheet"), chunks
+    elif extension == ".xls":
+        for sheet, chunks in _iter_xls(source, chunk_rows):
+            yield sanitize_name(f"{stem}_{sheet}", "sheet"), chunks
+    else:
+        raise ValueError(f"Unsupported file type: {extension} (expected one of {', '.join(SUPPORTED_EXTENSIONS)})")
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _key_columns(types, first_chunk):
+    """Pick columns that look like keys: named like one, or unique integers in the first chunk
+
+    Free text that happens to be unique (names, descriptions) is not indexed.
+    """
+    keys = []
+    for column, column_type in types.items():
+        values = first_chunk[column]
+        if KEY_NAME.search(column):
+            keys.append(column)
+        elif column_type == "INTEGER" and values.notna().all() and values.is_unique and len(values) > 1:
+            keys.append(column)
+    return keys[:MAX_KEY_INDEXES]
+
+def load_table(conn, table, chunks, progress=None):
+    """Create table from the first chunk's inferred types and insert every chunk; returns the row count"""
+    first = next(chunks, None)
+    if first is None:
+        return 0
+
+    types = infer_types(first)
+    columns = ", ".join(f"{_quote(column)} {column_type}" for column, column_type in types.items())
+    conn.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+    conn.execute(f"CREATE TABLE {_quote(table)} ({columns})")
+
+    insert = f"INSERT INTO {_quote(table)} VALUES ({', '.join('?' for _ in types)})"
+    rows = 0
+    chunk = first
+    while chunk is not None:
+        converted = convert_chunk(chunk, types)
+        conn.executemany(insert, converted.itertuples(index=False, name=None))
+        conn.commit()
+        rows += len(converted)
+        if progress:
+            progress(table, rows)
+        chunk = next(chunks, None)
+
+    for column in _key_columns(types, first):
+        conn.execute(f"CREATE INDEX {_quote(f'idx_{table}_{column}')} ON {_quote(table)} ({_quote(column)})")
+    conn.commit()
+    return rows
+
+def ingest_files(files, db_name, chunk_rows=INGEST_CHUNK_ROWS, progress=None):
+    """Import files into a new SQLite database and save it as a connection
+
+    files is a list of (file object or path, file name). Every CSV becomes
+    a table, every worksheet of an Excel file becomes a table. progress, if
+    given, is called with (table, rows loaded so far) after every chunk.
+    Returns {"db_id", "path", "tables": {table: rows}}.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(UPLOAD_DIR, f"{sanitize_name(db_name, 'upload')}_{uuid.uuid4().hex[:8]}.db"))
+
+    tables = {}
+    conn = sqlite3.connect(path)
+    try:
+        # The file is new and rebuilt from scratch on failure, so skip durability while loading
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -65536")
+
+        for source, filename in files:
+            for table, chunks in iter_tables(source, filename, chunk_rows):
+                while table in tables:
+                    table = f"{table}_2"
+                tables[table] = load_table(conn, table, chunks, progress)
+
+        # Statistics for the query planner, then a normal journal for readers
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(path)
+        raise
+    conn.close()
+
+    connection_info = {"db_type": "SQLite", "path": path, "read_only": True}
+    db_id = save_db_connection(db_name, connection_info, "SQLite")
+    return {"db_id": db_id, "path": path, "tables": tables}
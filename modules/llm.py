@@ -0,0 +1,94 @@
+# mod/llm.py - Helpers shared by the LLM prompts
+
+import os
+import threading
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def estimate_tokens(text):
+    """Roughly estimate the number of LLM tokens in text (about 4 characters per token)"""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+def iter_text_chunks(response):
+    """Yield the text of each chunk of a streamed Gemini response"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks that only carry finish or safety metadata have no text
+            continue
+        if text:
+            yield text
+
+def _read_usage(usage, response):
+    """Copy the token counts Gemini reports for a response into usage"""
+    metadata = getattr(response, "usage_metadata", None)
+    if usage is None or metadata is None:
+        return
+    if getattr(metadata, "prompt_token_count", None):
+        usage["prompt_tokens"] = metadata.prompt_token_count
+    if getattr(metadata, "candidates_token_count", None):
+        usage["response_tokens"] = metadata.candidates_token_count
+
+def gemini_backend(model_name, prompt, stream=False, usage=None):
+    """Send a prompt to Gemini, returning its text or an iterator of text chunks
+
+    If usage is a dict it receives the prompt and response token counts
+    Gemini reports (for a stream, once it is exhausted).
+    """
+    global _configured
+    import google.generativeai as genai
+    with _configure_lock:
+        if not _configured:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            _configured = True
+
+    model = genai.GenerativeModel(model_name)
+    if stream:
+        response = model.generate_content(prompt, stream=True)
+
+        def chunks():
+            yield from iter_text_chunks(response)
+            _read_usage(usage, response)
+        return chunks()
+
+    response = model.generate_content(prompt)
+    _read_usage(usage, response)
+    return response.text
+
+# Function every prompt goes through; replaced by benchmarks with an offline stub
+_backend = gemini_backend
+
+def set_backend(backend):
+    """Send prompts to backend(model_name, prompt, stream, usage) instead of Gemini; None restores Gemini"""
+    global _backend
+    _backend = backend or gemini_backend
+
+def _estimate_usage(usage, prompt, text):
+    """Fill token counts the backend did not report with estimates"""
+    if usage is not None:
+        usage.setdefault("prompt_tokens", estimate_tokens(prompt))
+        usage.setdefault("response_tokens", estimate_tokens(text))
+
+def generate_text(model_name, prompt, usage=None):
+    """Run a prompt through a model and return the response text"""
+    text = _backend(model_name, prompt, usage=usage)
+    _estimate_usage(usage, prompt, text)
+    return text
+
+def stream_text(model_name, prompt, usage=None):
+    """Run a prompt through a model and return an iterator of response text chunks"""
+    chunks = _backend(model_name, prompt, stream=True, usage=usage)
+    if usage is None:
+        return chunks
+
+    def counted():
+        text = []
+        for chunk in chunks:
+            text.append(chunk)
+            yield chunk
+        _estimate_usage(usage, prompt, "".join(text))
+    return counted()
@@ -0,0 +1,155 @@
+# mod/migrations.py - Versioned schema migrations for the lang2sql database
+
+import logging
+import threading
+from modules.db_utils import db_connection
+from modules.db_setup import create_base_tables
+
+logger = logging.getLogger(__name__)
+
+# MySQL errors raised when an index or column with the same name already exists
+DUPLICATE_KEY_NAME = 1061
+DUPLICATE_COLUMN_NAME = 1060
+
+# Chats updated per statement when backfilling chat titles
+BACKFILL_BATCH_SIZE = 1000
+
+# Seconds to wait for another process that is migrating the same database
+MIGRATION_LOCK_TIMEOUT = 60
+
+def _create_base_tables(conn, cursor):
+    create_base_tables(cursor)
+
+def backfill_chat_metadata(conn, cursor, batch_size=BACKFILL_BATCH_SIZE):
+    """Fill chat.title and chat.last_activity_at from existing messages, a range of chats at a time"""
+    cursor.execute("SELECT COALESCE(MAX(chat_id), 0) FROM chat")
+    max_chat_id = cursor.fetchone()[0]
+
+    for start in range(1, max_chat_id + 1, batch_size):
+        end = start + batch_size - 1
+        cursor.execute(
+            """
+            UPDATE chat c
+            SET c.title = (
+                    SELECT LEFT(m.content, 255) FROM message m
+                    WHERE m.chat_id = c.chat_id
+                    ORDER BY m.timestamp ASC, m.message_id ASC
+                    LIMIT 1
+                ),
+                c.last_activity_at = COALESCE(
+                    (SELECT MAX(m.timestamp) FROM message m WHERE m.chat_id = c.chat_id),
+                    c.created_at
+                )
+            WHERE c.chat_id BETWEEN %s AND %s AND c.last_activity_at IS NULL
+            """,
+            (start, end)
+        )
+        conn.commit()
+
+# (version, description, steps); a step is a SQL statement or a callable taking (conn, cursor)
+MIGRATIONS = [
+    (1, "create base tables", [_create_base_tables]),
+    (2, "add indexes for chat, message and query lookups", [
+        # Messages are paged by message_id and chats listed by (created_at, chat_id);
+        # session lookups by token already use the UNIQUE(token) index
+        "CREATE INDEX idx_message_chat_message ON message (chat_id, message_id)",
+        "CREATE INDEX idx_query_chat_timestamp ON query (chat_id, timestamp)",
+        "CREATE INDEX idx_chat_user_created ON chat (user_id, created_at, chat_id)"
+    ]),
+    (3, "store chat titles and last activity on the chat row", [
+        "ALTER TABLE chat ADD COLUMN title VARCHAR(255) NULL",
+        "ALTER TABLE chat ADD COLUMN last_activity_at DATETIME NULL",
+        backfill_chat_metadata
+    ]),
+    (4, "one session per user and an index for purging expired sessions", [
+        # Keep only the newest session of each user before making user_id unique
+        "DELETE s FROM sessions s JOIN sessions newer ON newer.user_id = s.user_id AND newer.id > s.id",
+        "CREATE UNIQUE INDEX uniq_sessions_user ON sessions (user_id)",
+        "CREATE INDEX idx_sessions_expires ON sessions (expires_at)"
+    ]),
+    (5, "store the trace of each generated query", [
+        "ALTER TABLE query ADD COLUMN duration_ms INT NULL",
+        "ALTER TABLE query ADD COLUMN prompt_tokens INT NULL",
+        "ALTER TABLE query ADD COLUMN response_tokens INT NULL",
+        "ALTER TABLE query ADD COLUMN result_rows INT NULL",
+        "ALTER TABLE query ADD COLUMN trace TEXT NULL"
+    ]),
+    (6, "record which server ran each query", [
+        "ALTER TABLE query ADD COLUMN routed_to VARCHAR(255) NULL"
+    ])
+]
+
+_migrated = False
+_lock = threading.Lock()
+
+def _run_step(conn, cursor, step):
+    """Run one migration step, tolerating indexes and columns that already exist"""
+    if callable(step):
+        step(conn, cursor)
+        return
+
+    try:
+        cursor.execute(step)
+    except Exception as err:
+        if getattr(err, 'errno', None) not in (DUPLICATE_KEY_NAME, DUPLICATE_COLUMN_NAME):
+            raise
+
+def get_schema_version(cursor):
+    """Get the highest applied migration version"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+def run_migrations(target_version=None):
+    """Apply pending migrations up to target_version (all of them by default)
+
+    Runs at most once per process; a MySQL named lock keeps concurrent
+    processes from migrating at the same time. Returns the list of
+    versions applied.
+    """
+    global _migrated
+    if _migrated and target_version is None:
+        return []
+
+    with _lock:
+        if _migrated and target_version is None:
+            return []
+
+        applied = []
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT GET_LOCK('lang2sql_migrations', %s)", (MIGRATION_LOCK_TIMEOUT,))
+                if cursor.fetchone()[0] != 1:
+                    raise RuntimeError("Timed out waiting for another process to finish migrating")
+
+                try:
+                    current = get_schema_version(cursor)
+                    for version, description, steps in MIGRATIONS:
+                        if version <= current or (target_version is not None and version > target_version):
+                            continue
+
+                        logger.info("Applying migration %s: %s", version, description)
+                        for step in steps:
+                            _run_step(conn, cursor, step)
+                        cursor.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                        conn.commit()
+                        applied.append(version)
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK('lang2sql_migrations')")
+                    cursor.fetchone()
+            finally:
+                cursor.close()
+
+        if target_version is None:
+            _migrated = True
+        return applied
@@ -0,0 +1,204 @@
+# mod/persistence.py - Write-behind queue for the messages and queries of chat turns
+
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from modules.db_utils import db_cursor
+from modules.query import RESULT_FORMAT, encode_result
+
+# Most turns written in one transaction
+PERSIST_BATCH_TURNS = int(os.getenv("PERSIST_BATCH_TURNS", "50"))
+
+# Seconds to wait for queued turns when the process exits
+PERSIST_SHUTDOWN_TIMEOUT = float(os.getenv("PERSIST_SHUTDOWN_TIMEOUT", "10"))
+
+# Length of the chat.title column
+CHAT_TITLE_LENGTH = 255
+
+logger = logging.getLogger(__name__)
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    "turns_written": 0,
+    "flushes": 0,
+    "failed_flushes": 0,
+    "largest_batch": 0,
+    "last_flush_seconds": 0.0,
+    "total_flush_seconds": 0.0
+}
+
+def new_turn(chat_id):
+    """Start collecting the writes of one chat turn"""
+    return {"chat_id": chat_id, "messages": [], "queries": []}
+
+def add_message(turn, content, is_system=False):
+    """Add a message to a turn, timestamped now rather than when it is written"""
+    turn["messages"].append((content, is_system, datetime.datetime.now()))
+
+def add_query(turn, natural_language_query, generated_sql=None, result=None, db_id=None, trace=None):
+    """Add a generated query, its result and its trace record (see modules.tracing) to a turn"""
+    turn["queries"].append((natural_language_query, generated_sql, result, db_id, trace))
+
+def _write_turns(cursor, turns):
+    """Write turns in their queue order with multi-row inserts"""
+    messages = [
+        (turn["chat_id"], content, is_system, timestamp)
+        for turn in turns
+        for content, is_system, timestamp in turn["messages"]
+    ]
+    if messages:
+        cursor.executemany(
+            "INSERT INTO message (chat_id, content, is_system, timestamp) VALUES (%s, %s, %s, %s)",
+            messages
+        )
+
+    # query_result rows need the id of their query row, so queries are inserted one at a time
+    results = []
+    for turn in turns:
+        for natural_language_query, generated_sql, result, db_id, trace in turn["queries"]:
+            trace = trace or {}
+            cursor.execute(
+                """
+                INSERT INTO query (chat_id, db_id, natural_language_query, generated_sql,
+                                   duration_ms, prompt_tokens, response_tokens, result_rows, routed_to, trace)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    turn["chat_id"], db_id, natural_language_query, generated_sql,
+                    trace.get("duration_ms"), trace.get("prompt_tokens"), trace.get("response_tokens"),
+                    trace.get("row_count"), trace.get("routed_to"), json.dumps(trace) if trace else None
+                )
+            )
+            if result is not None:
+                payload, row_count, byte_size = encode_result(result)
+                results.append((cursor.lastrowid, RESULT_FORMAT, payload, row_count, byte_size, len(payload)))
+    if results:
+        cursor.executemany(
+            """
+            INSERT INTO query_result (query_id, format, payload, row_count, byte_size, stored_size)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            results
+        )
+
+    # Keep each chat's title and last activity time current
+    chats = {}
+    for turn in turns:
+        if turn["messages"]:
+            chats.setdefault(turn["chat_id"], turn["messages"][0][0][:CHAT_TITLE_LENGTH])
+    for chat_id, title in chats.items():
+        cursor.execute(
+            "UPDATE chat SET last_activity_at = NOW(), title = COALESCE(title, %s) WHERE chat_id = %s",
+            (title, chat_id)
+        )
+
+def _flush(batch):
+    """Write a batch of (turn, future) in one transaction, retrying turn by turn if it fails"""
+    start = time.perf_counter()
+    errors = {}
+    try:
+        with db_cursor(commit=True) as cursor:
+            _write_turns(cursor, [turn for turn, _ in batch])
+    except Exception as err:
+        logger.exception("Writing %d queued turns failed", len(batch))
+        if len(batch) == 1:
+            errors[0] = err
+        else:
+            # Keep one bad turn from losing the others
+            for index, (turn, _) in enumerate(batch):
+                try:
+                    with db_cursor(commit=True) as cursor:
+                        _write_turns(cursor, [turn])
+                except Exception as turn_err:
+                    logger.exception("Writing a turn of chat %s failed", turn["chat_id"])
+                    errors[index] = turn_err
+
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats["flushes"] += 1
+        _stats["turns_written"] += len(batch) - len(errors)
+        _stats["failed_flushes"] += 1 if errors else 0
+        _stats["largest_batch"] = max(_stats["largest_batch"], len(batch))
+        _stats["last_flush_seconds"] = elapsed
+        _stats["total_flush_seconds"] += elapsed
+
+    for index, (turn, future) in enumerate(batch):
+        if index in errors:
+            future.set_exception(errors[index])
+        else:
+            future.set_result(turn["chat_id"])
+
+def _run_writer():
+    """Write queued turns, batching everything that queued up during the previous flush"""
+    stopping = False
+    while not stopping:
+        item = _queue.get()
+        batch = []
+        while True:
+            if item is None:
+                stopping = True
+            else:
+                batch.append(item)
+            if stopping or len(batch) >= PERSIST_BATCH_TURNS:
+                break
+            try:
+                item = _queue.get_nowait()
+            except queue.Empty:
+                break
+
+        if batch:
+            _flush(batch)
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run_writer, name="lang2sql-writer", daemon=True)
+            _writer.start()
+
+def submit_turn(turn):
+    """Queue a turn for writing and return a future that resolves once it is committed
+
+    A single writer thread writes turns in the order they were
+    submitted, so the turns of a chat are stored in order.
+    """
+    future = Future()
+    if not turn["messages"] and not turn["queries"]:
+        future.set_result(turn["chat_id"])
+        return future
+
+    _ensure_writer()
+    _queue.put((turn, future))
+    return future
+
+def shutdown(timeout=PERSIST_SHUTDOWN_TIMEOUT):
+    """Write everything still queued and stop the writer thread"""
+    global _writer
+    with _writer_lock:
+        writer = _writer
+        _writer = None
+    if writer is None or not writer.is_alive():
+        return
+    _queue.put(None)
+    writer.join(timeout)
+    if writer.is_alive():
+        logger.warning("Writer still busy after %.0fs, %d turns not written", timeout, _queue.qsize())
+
+atexit.register(shutdown)
+
+def get_persistence_stats():
+    """Get the queue depth and flush latency of the writer"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = _queue.qsize()
+    stats["avg_flush_seconds"] = stats["total_flush_seconds"] / stats["flushes"] if stats["flushes"] else 0.0
+    return stats
@@ -0,0 +1,72 @@
+# mod/pipeline.py - Staged executor for the work done in a chat turn
+
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="lang2sql-turn")
+
+def _timed(name, function, timings, /, *args, **kwargs):
+    """Run function and record its duration in timings[name]"""
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
+
+def run_stages(stages, timings=None):
+    """Run named stages on the thread pool as soon as their dependencies finish
+
+    stages maps a stage name to (function, [dependency names]). Each
+    function is called with the results of its dependencies as keyword
+    arguments. Returns {name: result}; if timings is a dict it receives
+    the duration of every stage in seconds. The first stage to fail
+    raises its exception here.
+    """
+    results = {}
+    running = {}
+    pending = dict(stages)
+
+    while pending or running:
+        # Start every stage whose dependencies are done
+        for name, (function, dependencies) in list(pending.items()):
+            if all(dependency in results for dependency in dependencies):
+                kwargs = {dependency: results[dependency] for dependency in dependencies}
+                # Stages run in the caller's context, e.g. to be attributed to its query profile
+                context = contextvars.copy_context()
+                running[_executor.submit(context.run, _timed, name, function, timings, **kwargs)] = name
+                del pending[name]
+
+        if not running:
+            raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[running.pop(future)] = future.result()
+
+    return results
+
+def run_in_background(name, function, *args, timings=None, **kwargs):
+    """Run function off the critical path and return its future
+
+    Failures are logged, since nobody may wait on the result.
+    """
+    future = _executor.submit(_timed, name, function, timings, *args, **kwargs)
+
+    def log_failure(done):
+        if done.exception() is not None:
+            logger.error("Background stage %s failed", name, exc_info=done.exception())
+
+    future.add_done_callback(log_failure)
+    return future
+
+def format_timings(timings):
+    """Format stage durations for logging"""
+    return ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items())
@@ -0,0 +1,197 @@
+# mod/preflight.py - EXPLAIN-based cost guard for generated SQL
+
+import logging
+import os
+import re
+from modules.executor import QUERY_TIMEOUT_MS, RESULT_MAX_ROWS, is_pageable, limit_sql, split_limit
+from modules.sql_utils import first_keyword, normalize_sql, strip_comments_and_literals
+
+# Default thresholds on the estimated number of rows a statement reads; 0 disables one.
+# Saved connections override them with the same names in lowercase (e.g. "preflight_reject_rows").
+PREFLIGHT_REJECT_ROWS = int(os.getenv("PREFLIGHT_REJECT_ROWS", "50000000"))
+PREFLIGHT_CONFIRM_ROWS = int(os.getenv("PREFLIGHT_CONFIRM_ROWS", "5000000"))
+PREFLIGHT_LIMIT_ROWS = int(os.getenv("PREFLIGHT_LIMIT_ROWS", "100000"))
+
+# Statements the dialects can EXPLAIN without running them
+EXPLAINABLE_STATEMENTS = {"select", "with", "update", "delete"}
+
+SQLITE_PLAN_STEP = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?([\w$]+)(?:\s+AS\s+[\w$]+)?(?:\s+USING\s+(.*))?$")
+
+logger = logging.getLogger(__name__)
+
+ALIASES = re.compile(r"""(?:\bfrom|\bjoin|,)\s*[`"\[]?([\w$]+)[`"\]]?\s+(?:as\s+)?([\w$]+)""", re.IGNORECASE)
+
+def get_guard_settings(connection_info):
+    """Return the pre-flight thresholds and statement timeout (see modules.executor) of a saved connection"""
+    return {
+        "reject_rows": int(connection_info.get("preflight_reject_rows", PREFLIGHT_REJECT_ROWS)),
+        "confirm_rows": int(connection_info.get("preflight_confirm_rows", PREFLIGHT_CONFIRM_ROWS)),
+        "limit_rows": int(connection_info.get("preflight_limit_rows", PREFLIGHT_LIMIT_ROWS)),
+        "timeout_ms": int(connection_info.get("statement_timeout_ms", QUERY_TIMEOUT_MS))
+    }
+
+def _mysql_estimate(connection, sql):
+    """Rows examined: the product of the rows column over the tables of one SELECT, summed over SELECTs"""
+    from sqlalchemy import text
+    selects = {}
+    for row in connection.execute(text(f"EXPLAIN {sql}")).mappings():
+        if row.get("rows") is None:
+            continue
+        select_id = row.get("id")
+        selects[select_id] = selects.get(select_id, 1) * int(row["rows"])
+    return sum(selects.values()) if selects else None
+
+def _postgres_scanned(node, table_rows):
+    """Rows read by a plan node and its children; the inner side of a nested loop runs once per outer row"""
+    children = node.get("Plans", [])
+    if node.get("Node Type") == "Nested Loop" and len(children) == 2:
+        outer, inner = children
+        return _postgres_scanned(outer, table_rows) + outer.get("Plan Rows", 1) * _postgres_scanned(inner, table_rows)
+
+    rows = 0
+    if node.get("Node Type") == "Seq Scan":
+        # Plan Rows of a sequential scan counts the rows left after its filter
+        rows = max(table_rows.get(node.get("Relation Name"), -1), node.get("Plan Rows", 0))
+    elif "Relation Name" in node:
+        rows = node.get("Plan Rows", 0)
+    return rows + sum(_postgres_scanned(child, table_rows) for child in children)
+
+def _relations(node):
+    names = {node["Relation Name"]} if "Relation Name" in node else set()
+    for child in node.get("Plans", []):
+        names |= _relations(child)
+    return names
+
+def _postgres_estimate(connection, sql):
+    import json
+    from sqlalchemy import bindparam, text
+    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+
+    # Table sizes from the planner statistics (-1 for tables never analyzed)
+    names = sorted(_relations(root))
+    table_rows = {}
+    if names:
+        statement = text("SELECT relname, reltuples FROM pg_class WHERE relname IN :names").bindparams(
+            bindparam("names", expanding=True)
+        )
+        table_rows = {name: float(rows) for name, rows in connection.execute(statement, {"names": names})}
+    return int(_postgres_scanned(root, table_rows))
+
+def _sqlite_table_rows(connection, table, stats):
+    """Rows in a table from sqlite_stat1 (written by ANALYZE), else its largest rowid"""
+    from sqlalchemy import text
+    if table in stats:
+        return stats[table]
+    try:
+        return connection.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar() or 0
+    except Exception:
+        # WITHOUT ROWID tables, views and CTE names
+        return None
+
+def _sqlite_step_rows(connection, table, using, stats, index_stats):
+    """Estimate the rows one SCAN or SEARCH step reads per loop"""
+    table_rows = _sqlite_table_rows(connection, table, stats)
+    if table_rows is None:
+        return None
+    if using is None or (using.startswith("COVERING INDEX") and "(" not in using):
+        return table_rows
+
+    if "PRIMARY KEY" in using and "=" in using and not re.search(r"[<>]", using):
+        return 1
+    if re.search(r"[<>]", using):
+        # SQLite itself assumes a range keeps about a quarter of the rows
+        return max(table_rows // 4, 1)
+
+    index = re.match(r"(?:COVERING\s+)?INDEX\s+([\w$]+)", using)
+    if index and index.group(1) in index_stats:
+        return index_stats[index.group(1)]
+    return min(table_rows, 10)
+
+def _sqlite_estimate(connection, sql):
+    """Rows read: the product of the loop estimates of each query level, summed over the levels"""
+    from sqlalchemy import text
+    stats, index_stats = {}, {}
+    try:
+        for table, index, stat in connection.execute(text("SELECT tbl, idx, stat FROM sqlite_stat1")):
+            numbers = [int(number) for number in stat.split()[:2]]
+            stats[table] = max(stats.get(table, 0), numbers[0])
+            if index and len(numbers) > 1:
+                index_stats[index] = numbers[1]
+    except Exception:
+        # No ANALYZE has run on this file
+        pass
+
+    # The plan names tables by their alias
+    aliases = {alias.lower(): table for table, alias in ALIASES.findall(strip_comments_and_literals(sql))}
+
+    levels = {}
+    for _, parent, _, detail in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")):
+        step = SQLITE_PLAN_STEP.match(detail)
+        if not step or step.group(2) in ("CONSTANT", "SUBQUERY"):
+            continue
+        table = aliases.get(step.group(2).lower(), step.group(2))
+        rows = _sqlite_step_rows(connection, table, step.group(3), stats, index_stats)
+        if rows is not None:
+            levels[parent] = levels.get(parent, 1) * max(rows, 1)
+    return sum(levels.values()) if levels else None
+
+ESTIMATORS = {
+    "mysql": _mysql_estimate,
+    "postgresql": _postgres_estimate,
+    "sqlite": _sqlite_estimate
+}
+
+def estimate_rows(db, sql):
+    """Estimate how many rows sql reads with the dialect's EXPLAIN, or None if it cannot be explained"""
+    engine = db._engine
+    estimator = ESTIMATORS.get(engine.dialect.name)
+    if estimator is None or first_keyword(sql) not in EXPLAINABLE_STATEMENTS:
+        return None
+
+    try:
+        # EXPLAIN output cannot be read through a server-side cursor
+        with engine.connect() as connection:
+            return estimator(connection.execution_options(stream_results=False), normalize_sql(sql))
+    except Exception as e:
+        # Invalid SQL fails again when it runs, with the error shown to the user
+        logger.warning("Pre-flight EXPLAIN failed on %s, running without a cost estimate: %s", engine.dialect.name, e)
+        return None
+
+def preflight(db, sql, settings, confirmed=False, max_rows=RESULT_MAX_ROWS + 1):
+    """Decide how to run sql based on its estimated cost
+
+    Returns {"action", "estimated_rows", "sql", "message"} where action is
+    "reject" (too expensive to run), "confirm" (the user has to confirm it
+    first, unless confirmed), "limit" (run sql, which has a LIMIT of
+    max_rows added) or "run".
+    """
+    estimated = estimate_rows(db, sql)
+    decision = {"action": "run", "estimated_rows": estimated, "sql": sql, "message": None}
+    if estimated is None:
+        return decision
+
+    if settings["reject_rows"] and estimated >= settings["reject_rows"]:
+        decision["action"] = "reject"
+        decision["message"] = (
+            f"⛔ This query was not run: it would read about {estimated:,} rows, "
+            f"over this connection's limit of {settings['reject_rows']:,}. Try a narrower question.\n\n"
+            f"The query was: {sql}"
+        )
+        return decision
+
+    if settings["confirm_rows"] and estimated >= settings["confirm_rows"] and not confirmed:
+        decision["action"] = "confirm"
+        decision["message"] = (
+            f"⚠️ This query would read about {estimated:,} rows. Confirm below to run it anyway.\n\n"
+            f"The query was: {sql}"
+        )
+        return decision
+
+    # Unbounded reads of large tables only need the rows that are shown
+    if settings["limit_rows"] and estimated >= settings["limit_rows"] and is_pageable(sql) and split_limit(sql)[1] is None:
+        decision["action"] = "limit"
+        decision["sql"] = limit_sql(sql, max_rows)
+    return decision
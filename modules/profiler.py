@@ -0,0 +1,178 @@
+# mod/profiler.py - Opt-in profiler for queries against the lang2sql database
+
+import contextvars
+import json
+import os
+import re
+import sys
+import time
+
+# Profile every rerun of every session (the sidebar toggle enables it per session)
+DB_PROFILE = os.getenv("DB_PROFILE", "0") == "1"
+
+# Append every finished rerun profile as a JSON line to this file
+DB_PROFILE_LOG = os.getenv("DB_PROFILE_LOG")
+
+# A statement run this many times in one rerun with different parameters is flagged as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_PROFILE_N_PLUS_ONE", "3"))
+
+# Frames of these files are skipped when looking for the caller of a statement
+_SKIPPED_FILES = ("profiler.py", "db_utils.py", "contextlib.py")
+
+_current = contextvars.ContextVar("db_profile", default=None)
+
+def start_profile(label):
+    """Start recording the statements run in this context (and the pipeline stages it starts)"""
+    profile = {
+        "label": label,
+        "started_at": time.time(),
+        "checkouts": 0,
+        "statements": []
+    }
+    return _current.set(profile)
+
+def finish_profile(token):
+    """Stop recording and return the report of the profile started with token"""
+    profile = _current.get()
+    _current.reset(token)
+    if profile is None:
+        return None
+
+    report = analyze_profile(profile)
+    if DB_PROFILE_LOG:
+        with open(DB_PROFILE_LOG, "a") as f:
+            f.write(json.dumps(report, default=str) + "\n")
+    return report
+
+def _caller():
+    """Name the functions that issued a statement: the caller and the function it was called from"""
+    names = []
+    frame = sys._getframe(2)
+    while frame is not None and len(names) < 2:
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename not in _SKIPPED_FILES:
+            names.append(f"{frame.f_code.co_name} ({filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return names[0] if names else "?", names[1] if len(names) > 1 else None
+
+def normalize_statement(statement):
+    """Collapse whitespace so the same statement formatted differently groups together"""
+    return re.sub(r"\s+", " ", statement).strip()
+
+class ProfiledCursor:
+    """Cursor wrapper recording each statement, its duration and the rows fetched"""
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+        self._entry = None
+
+    def _record(self, method, statement, params):
+        caller, via = _caller()
+        start = time.perf_counter()
+        try:
+            return method(statement, params) if params is not None else method(statement)
+        finally:
+            self._entry = {
+                "statement": normalize_statement(statement),
+                "params": repr(params),
+                "seconds": time.perf_counter() - start,
+                "rows": 0,
+                "rowcount": self._cursor.rowcount,
+                "caller": caller,
+                "via": via
+            }
+            self._profile["statements"].append(self._entry)
+
+    def execute(self, statement, params=None):
+        return self._record(self._cursor.execute, statement, params)
+
+    def executemany(self, statement, seq_params):
+        return self._record(self._cursor.executemany, statement, seq_params)
+
+    def _fetched(self, rows):
+        if self._entry is not None:
+            self._entry["rows"] += rows
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._fetched(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ProfiledConnection:
+    """Connection wrapper handing out profiled cursors"""
+
+    def __init__(self, conn, profile):
+        self._conn = conn
+        self._profile = profile
+        profile["checkouts"] += 1
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self._conn.cursor(*args, **kwargs), self._profile)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def profile_connection(conn):
+    """Wrap conn if the current context is being profiled"""
+    profile = _current.get()
+    if profile is None:
+        return conn
+    return ProfiledConnection(conn, profile)
+
+def analyze_profile(profile):
+    """Summarize a profile and flag N+1 patterns and duplicate identical queries"""
+    statements = list(profile["statements"])
+
+    groups = {}
+    for entry in statements:
+        group = groups.setdefault(entry["statement"], {"count": 0, "seconds": 0.0, "params": {}, "callers": set()})
+        group["count"] += 1
+        group["seconds"] += entry["seconds"]
+        group["params"][entry["params"]] = group["params"].get(entry["params"], 0) + 1
+        group["callers"].add(entry["caller"])
+
+    duplicates = []
+    n_plus_one = []
+    for statement, group in groups.items():
+        for params, count in group["params"].items():
+            if count > 1:
+                duplicates.append({"statement": statement, "params": params, "count": count,
+                                   "callers": sorted(group["callers"])})
+        if len(group["params"]) >= N_PLUS_ONE_THRESHOLD:
+            n_plus_one.append({"statement": statement, "count": group["count"],
+                               "distinct_params": len(group["params"]), "callers": sorted(group["callers"])})
+
+    return {
+        "label": profile["label"],
+        "started_at": profile["started_at"],
+        "checkouts": profile["checkouts"],
+        "round_trips": len(statements) + profile["checkouts"],
+        "statement_count": len(statements),
+        "total_seconds": sum(entry["seconds"] for entry in statements),
+        "rows": sum(entry["rows"] for entry in statements),
+        "statements": statements,
+        "duplicates": duplicates,
+        "n_plus_one": n_plus_one
+    }
+
+def dump_profiles(reports):
+    """Serialize rerun reports as JSON, for download or a file"""
+    return json.dumps(reports, indent=2, default=str)
@@ -1,49 +1,91 @@
 # mod/query.py - Query tracking functions
 
-from modules.db_utils import get_db_connection
+import json
+import zlib
+from modules.db_utils import db_cursor
+
+# Storage format of query_result.payload
+RESULT_FORMAT = "json+zlib"
+
+def encode_result(result):
+    """Compress a query result for storage, returning (payload, row_count, byte_size)"""
+    data = json.dumps(result, default=str, separators=(",", ":")).encode()
+    row_count = result["row_count"] if isinstance(result, dict) else 0
+    return zlib.compress(data, 6), row_count, len(data)
+
+def decode_result(result_format, payload):
+    """Decompress a stored query result"""
+    if result_format != RESULT_FORMAT:
+        raise ValueError(f"Unknown result format: {result_format}")
+    return json.loads(zlib.decompress(payload))
 
 def save_query(chat_id, natural_language_query, generated_sql=None, result=None, db_id=None):
     """Save a query to the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Convert result to string if it's not already
-    if result is not None and not isinstance(result, str):
-        result = str(result)
-    
-    cursor.execute(
-        """
-        INSERT INTO query (chat_id, db_id, natural_language_query, generated_sql, result)
-        VALUES (%s, %s, %s, %s, %s)
-        """,
-        (chat_id, db_id, natural_language_query, generated_sql, result)
-    )
-    
-    query_id = cursor.lastrowid
-    conn.commit()
-    cursor.close()
-    conn.close()
-    
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            INSERT INTO query (chat_id, db_id, natural_language_query, generated_sql)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (chat_id, db_id, natural_language_query, generated_sql)
+        )
+
+        query_id = cursor.lastrowid
+
+        # Store the result compressed, with its size as metadata
+        if result is not None:
+            payload, row_count, byte_size = encode_result(result)
+            cursor.execute(
+                """
+                INSERT INTO query_result (query_id, format, payload, row_count, byte_size, stored_size)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                (query_id, RESULT_FORMAT, payload, row_count, byte_size, len(payload))
+            )
+
     return query_id
 
 def get_chat_queries(chat_id):
-    """Get all queries for a chat"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute(
-        """
-        SELECT q.*, db.db_name
-        FROM query q
-        LEFT JOIN database_connection db ON q.db_id = db.db_id
-        WHERE q.chat_id = %s
-        ORDER BY q.timestamp ASC
-        """,
-        (chat_id,)
-    )
-    
-    queries = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return queries
\ No newline at end of file
+    """Get all queries for a chat, without their results"""
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            """
+            SELECT q.query_id, q.chat_id, q.db_id, q.natural_language_query,
+                   q.generated_sql, q.timestamp, db.db_name,
+                   q.duration_ms, q.prompt_tokens, q.response_tokens, q.routed_to,
+                   r.row_count, r.byte_size, r.stored_size
+            FROM query q
+            LEFT JOIN database_connection db ON q.db_id = db.db_id
+            LEFT JOIN query_result r ON r.query_id = q.query_id
+            WHERE q.chat_id = %s
+            ORDER BY q.timestamp ASC
+            """,
+            (chat_id,)
+        )
+
+        queries = cursor.fetchall()
+
+    return queries
+
+def get_query_result(query_id):
+    """Get the stored result of a query"""
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(
+            """
+            SELECT r.format, r.payload, q.result
+            FROM query q
+            LEFT JOIN query_result r ON r.query_id = q.query_id
+            WHERE q.query_id = %s
+            """,
+            (query_id,)
+        )
+
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+    if row['payload'] is not None:
+        return decode_result(row['format'], row['payload'])
+
+    # Queries saved before results moved to query_result
+    return row['result']
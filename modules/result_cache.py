@@ -0,0 +1,62 @@
+# mod/result_cache.py - Cache of read-only query results per connection
+
+import os
+from modules.cache_utils import LRUCache
+from modules.sql_utils import is_read_only, normalize_sql, referenced_tables
+
+# Cache settings; connections can override the TTL with "result_cache_ttl"
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+
+def _result_size(entry):
+    result = entry["result"]
+    return result["bytes"] if isinstance(result, dict) else len(str(result))
+
+_results = LRUCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    ttl=RESULT_CACHE_TTL,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    sizeof=_result_size
+)
+
+def get_result_ttl(connection_info):
+    """Return the result cache TTL in seconds for a saved connection"""
+    return float(connection_info.get("result_cache_ttl", RESULT_CACHE_TTL))
+
+def get_cached_result(db_id, sql):
+    """Return the cached result of a read-only statement, or None"""
+    if not is_read_only(sql):
+        return None
+    entry = _results.get((db_id, normalize_sql(sql)))
+    return entry["result"] if entry else None
+
+def cache_result(db_id, sql, result, ttl=None):
+    """Cache the result of a read-only statement along with the tables it read"""
+    ttl = RESULT_CACHE_TTL if ttl is None else ttl
+    if ttl <= 0 or not is_read_only(sql):
+        return False
+
+    entry = {"result": result, "tables": referenced_tables(sql)}
+    if _result_size(entry) > RESULT_CACHE_MAX_ENTRY_BYTES:
+        return False
+    return _results.set((db_id, normalize_sql(sql)), entry, ttl=ttl)
+
+def invalidate_results(db_id, tables=None):
+    """Drop cached results of db_id that read any of tables (all of them if tables is None)
+
+    Results whose tables could not be determined, such as SHOW TABLES, are
+    dropped on every write.
+    """
+    if tables is None:
+        return _results.discard_where(lambda key, entry: key[0] == db_id)
+
+    tables = {table.lower() for table in tables}
+    return _results.discard_where(
+        lambda key, entry: key[0] == db_id and (not entry["tables"] or not entry["tables"].isdisjoint(tables))
+    )
+
+def get_result_cache_stats():
+    """Return hit/miss counters and memory use of the result cache"""
+    return _results.stats()
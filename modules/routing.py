@@ -0,0 +1,200 @@
+# mod/routing.py - Read-replica routing for target database connections
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from modules.dialects import create_query_engine, get_db_type
+from modules.sql_utils import is_read_only, referenced_tables
+
+# How read-only statements pick a replica: "round_robin" or "least_loaded"
+# (fewest statements in flight); connections override it with "replica_routing"
+REPLICA_ROUTING = os.getenv("REPLICA_ROUTING", "round_robin")
+
+# A replica that could not be reached is skipped for this many seconds
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Reads of tables written on the primary this recently go to the primary too, so
+# neither the user nor the result cache sees a replica that has not caught up
+REPLICA_LAG_SECONDS = float(os.getenv("REPLICA_LAG_SECONDS", "10"))
+
+ROUTING_POLICIES = ("round_robin", "least_loaded")
+
+PRIMARY = "primary"
+
+logger = logging.getLogger(__name__)
+
+def replica_infos(connection_info):
+    """Return the connection_info of every replica of a connection
+
+    connection_info["replicas"] lists dicts that override the primary's
+    settings, usually just host and port. SQLite files have no replicas.
+    """
+    if get_db_type(connection_info) == "SQLite" or "uri" in connection_info:
+        return []
+
+    primary = {key: value for key, value in connection_info.items() if key not in ("replicas", "replica_routing")}
+    return [dict(primary, **replica) for replica in connection_info.get("replicas") or []]
+
+def _replica_name(index, info):
+    return f"replica {index + 1} ({info.get('host')}:{info.get('port')})"
+
+def attach_router(db, connection_info):
+    """Give db a router over the replicas of its connection; engines are created on first use"""
+    replicas = replica_infos(connection_info)
+    policy = connection_info.get("replica_routing") or REPLICA_ROUTING
+    if policy not in ROUTING_POLICIES:
+        raise ValueError(f"Unknown replica routing: {policy} (expected one of {', '.join(ROUTING_POLICIES)})")
+
+    db._router = {
+        "policy": policy,
+        "replicas": [
+            {
+                "name": _replica_name(index, info),
+                "info": info,
+                "engine": None,
+                "in_flight": 0,
+                "routed": 0,
+                "failures": 0,
+                "down_until": 0.0
+            }
+            for index, info in enumerate(replicas)
+        ],
+        "next": 0,
+        "primary_reads": 0,
+        "written": {},
+        "all_written_at": 0.0,
+        "lock": threading.Lock()
+    } if replicas else None
+    return db
+
+def dispose_router(db):
+    """Close the pooled connections of every replica engine of db"""
+    router = getattr(db, "_router", None)
+    if router is None:
+        return
+    for replica in router["replicas"]:
+        if replica["engine"] is not None:
+            replica["engine"].dispose()
+
+def note_write(db, tables):
+    """Record a write to tables on the primary of db; None means any table may have changed"""
+    router = getattr(db, "_router", None)
+    if router is None:
+        return
+    now = time.monotonic()
+    with router["lock"]:
+        if tables is None:
+            router["all_written_at"] = now
+        else:
+            for table in tables:
+                router["written"][table] = now
+
+def _recently_written(router, sql):
+    """Check whether sql reads a table written on the primary within REPLICA_LAG_SECONDS"""
+    since = time.monotonic() - REPLICA_LAG_SECONDS
+    with router["lock"]:
+        if router["all_written_at"] > since:
+            return True
+        # Forget writes old enough for the replicas to have applied them
+        router["written"] = {table: at for table, at in router["written"].items() if at > since}
+        if not router["written"]:
+            return False
+        written = set(router["written"])
+    return bool(written & referenced_tables(sql))
+
+def _candidates(router):
+    """Order the replicas that are up by the routing policy"""
+    now = time.monotonic()
+    with router["lock"]:
+        replicas = [replica for replica in router["replicas"] if replica["down_until"] <= now]
+        if not replicas:
+            return []
+
+        # Rotate so ties and round-robin both spread statements over the replicas
+        start = router["next"] % len(replicas)
+        router["next"] += 1
+        replicas = replicas[start:] + replicas[:start]
+        if router["policy"] == "least_loaded":
+            replicas.sort(key=lambda replica: replica["in_flight"])
+        return replicas
+
+def _replica_engine(router, replica):
+    with router["lock"]:
+        if replica["engine"] is None:
+            replica["engine"] = create_query_engine(replica["info"])
+        return replica["engine"]
+
+def _mark_down(router, replica, error):
+    with router["lock"]:
+        replica["failures"] += 1
+        replica["down_until"] = time.monotonic() + REPLICA_RETRY_SECONDS
+    logger.warning("Replica %s failed, routing to the next server for %ss: %s", replica["name"], REPLICA_RETRY_SECONDS, error)
+
+@contextmanager
+def routed_connection(db, sql):
+    """Yield (connection, routed_to) for running sql on db
+
+    Read-only statements go to a replica picked by the routing policy,
+    falling back to the next replica and finally to the primary when a
+    replica cannot be connected to. Writes, DDL and connections without
+    replicas use the primary, as do reads of tables written recently (see
+    note_write), which a lagging replica could still miss.
+    """
+    router = getattr(db, "_router", None)
+    read_only = router is not None and is_read_only(sql)
+    if read_only and not _recently_written(router, sql):
+        from sqlalchemy.exc import DBAPIError
+
+        for replica in _candidates(router):
+            try:
+                connection = _replica_engine(router, replica).connect()
+            except DBAPIError as e:
+                _mark_down(router, replica, e)
+                continue
+
+            with router["lock"]:
+                replica["in_flight"] += 1
+                replica["routed"] += 1
+            try:
+                with connection:
+                    yield connection, replica["name"]
+            except DBAPIError as e:
+                # The server went away mid-statement; later statements skip it
+                if e.connection_invalidated:
+                    _mark_down(router, replica, e)
+                raise
+            finally:
+                with router["lock"]:
+                    replica["in_flight"] -= 1
+            return
+
+    if read_only:
+        with router["lock"]:
+            router["primary_reads"] += 1
+    with db._engine.connect() as connection:
+        yield connection, PRIMARY
+
+def get_routing_stats(db):
+    """Return per-server routing counters of db, or None without replicas"""
+    router = getattr(db, "_router", None)
+    if router is None:
+        return None
+
+    now = time.monotonic()
+    with router["lock"]:
+        return {
+            "policy": router["policy"],
+            "primary_reads": router["primary_reads"],
+            "replicas": [
+                {
+                    "name": replica["name"],
+                    "routed": replica["routed"],
+                    "in_flight": replica["in_flight"],
+                    "failures": replica["failures"],
+                    "up": replica["down_until"] <= now
+                }
+                for replica in router["replicas"]
+            ]
+        }
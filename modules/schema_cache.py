@@ -0,0 +1,122 @@
+# mod/schema_cache.py - Cached schema descriptions with change detection
+
+import hashlib
+import os
+import threading
+import time
+from modules.engine_registry import get_query_db, invalidate_query_db
+from modules.schema_index import build_table_index
+
+# Minimum number of seconds between fingerprint checks for one connection
+SCHEMA_CHECK_INTERVAL = float(os.getenv("SCHEMA_CHECK_INTERVAL", "30"))
+
+# One cheap aggregate per dialect that changes whenever tables or columns do.
+# MySQL also folds in table update times, so sample rows are refreshed after
+# writes once information_schema statistics catch up.
+FINGERPRINT_QUERIES = {
+    "mysql": """
+        SELECT
+            (SELECT COUNT(*) FROM information_schema.columns
+             WHERE table_schema = DATABASE()),
+            (SELECT SUM(CRC32(CONCAT_WS(':', table_name, column_name, column_type,
+                                        is_nullable, ordinal_position, column_comment)))
+             FROM information_schema.columns
+             WHERE table_schema = DATABASE()),
+            (SELECT MAX(COALESCE(update_time, create_time)) FROM information_schema.tables
+             WHERE table_schema = DATABASE())
+    """,
+    "postgresql": """
+        SELECT COUNT(*),
+               SUM(hashtext(table_name || ':' || column_name || ':' || data_type
+                            || ':' || is_nullable || ':' || ordinal_position))
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+    """,
+    "sqlite": "SELECT COUNT(*), group_concat(sql, ';') FROM sqlite_master"
+}
+
+_schemas = {}
+_build_locks = {}
+_lock = threading.Lock()
+
+def get_schema_fingerprint(db):
+    """Return a digest of the target database schema, or None if unsupported"""
+    query = FINGERPRINT_QUERIES.get(db.dialect)
+    if query is None:
+        return None
+
+    from sqlalchemy import text
+    with db._engine.connect() as connection:
+        row = connection.execute(text(query)).fetchone()
+
+    return hashlib.sha256(repr(tuple(row)).encode()).hexdigest()[:16]
+
+def _structure_digest(db, table_names):
+    """Digest table and column definitions only, ignoring sample rows and update times"""
+    parts = []
+    for table_name in table_names:
+        table = db._metadata.tables.get(table_name)
+        columns = [f"{column.name}:{column.type!r}" for column in table.columns] if table is not None else []
+        parts.append(f"{table_name}({','.join(columns)})")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+def _build_schema(db, fingerprint):
+    """Describe every usable table of db"""
+    tables = {}
+    for table_name in sorted(db.get_usable_table_names()):
+        tables[table_name] = db.get_table_info([table_name])
+
+    return {
+        "fingerprint": fingerprint,
+        "structure": _structure_digest(db, list(tables)),
+        "tables": tables,
+        "table_info": "\n\n".join(tables.values()),
+        "index": build_table_index(db, list(tables)),
+        "built_at": time.time(),
+        "checked_at": time.monotonic()
+    }
+
+def _get_build_lock(db_id):
+    with _lock:
+        if db_id not in _build_locks:
+            _build_locks[db_id] = threading.Lock()
+        return _build_locks[db_id]
+
+def load_schema(db_id, connection_info, refresh=False):
+    """Return (db, schema) for a saved connection
+
+    The schema description is reused until the fingerprint of the target
+    database changes. Fingerprints are checked at most once every
+    SCHEMA_CHECK_INTERVAL seconds.
+    """
+    if refresh:
+        refresh_schema(db_id)
+    db = get_query_db(db_id, connection_info)
+
+    with _get_build_lock(db_id):
+        schema = _schemas.get(db_id)
+
+        if schema is not None:
+            if time.monotonic() - schema["checked_at"] < SCHEMA_CHECK_INTERVAL:
+                return db, schema
+
+            fingerprint = get_schema_fingerprint(db)
+            if fingerprint is not None and fingerprint == schema["fingerprint"]:
+                schema["checked_at"] = time.monotonic()
+                return db, schema
+
+            # Schema changed: rebuild the engine so its reflected metadata is current
+            invalidate_query_db(db_id)
+            db = get_query_db(db_id, connection_info)
+
+        fingerprint = get_schema_fingerprint(db)
+        schema = _build_schema(db, fingerprint)
+        _schemas[db_id] = schema
+
+    return db, schema
+
+def refresh_schema(db_id):
+    """Forget the cached schema for db_id so the next question rebuilds it"""
+    with _get_build_lock(db_id):
+        _schemas.pop(db_id, None)
+    invalidate_query_db(db_id)
@@ -0,0 +1,156 @@
+# mod/schema_index.py - Lexical index for picking the tables relevant to a question
+
+import math
+import os
+import re
+from collections import Counter
+from modules.llm import estimate_tokens
+
+# Retrieval settings
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "5"))
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", "6000"))
+SCHEMA_MIN_SCORE = float(os.getenv("SCHEMA_MIN_SCORE", "1.0"))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Table names count more than column names or comments
+TABLE_NAME_WEIGHT = 3
+
+STOPWORDS = {
+    "a", "all", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does",
+    "each", "for", "from", "get", "give", "how", "i", "in", "is", "it", "list",
+    "many", "me", "much", "my", "of", "on", "or", "our", "show", "that", "the",
+    "their", "them", "there", "these", "this", "to", "was", "we", "were", "what",
+    "when", "where", "which", "who", "with", "you"
+}
+
+def _stem(token):
+    """Strip simple English plural endings"""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """Split identifiers and prose into lowercase search terms"""
+    if not text:
+        return []
+    # Split camelCase before lowercasing
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(text))
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [_stem(word) for word in words if word not in STOPWORDS]
+
+def _describe_table(table):
+    """Collect search terms and foreign-key targets from a reflected table"""
+    terms = tokenize(table.name) * TABLE_NAME_WEIGHT
+    terms += tokenize(table.comment)
+    references = set()
+
+    for column in table.columns:
+        terms += tokenize(column.name)
+        terms += tokenize(column.comment)
+        for foreign_key in column.foreign_keys:
+            references.add(foreign_key.column.table.name)
+
+    return terms, references
+
+def build_table_index(db, table_names):
+    """Build a BM25 index over the reflected tables of db"""
+    documents = {}
+    neighbours = {name: set() for name in table_names}
+
+    for table_name in table_names:
+        table = db._metadata.tables.get(table_name)
+        if table is None:
+            documents[table_name] = Counter(tokenize(table_name) * TABLE_NAME_WEIGHT)
+            continue
+
+        terms, references = _describe_table(table)
+        documents[table_name] = Counter(terms)
+
+        # Foreign keys link tables in both directions
+        for referenced in references:
+            if referenced in neighbours and referenced != table_name:
+                neighbours[table_name].add(referenced)
+                neighbours[referenced].add(table_name)
+
+    document_frequency = Counter()
+    for terms in documents.values():
+        document_frequency.update(terms.keys())
+
+    lengths = {name: sum(terms.values()) for name, terms in documents.items()}
+    average_length = sum(lengths.values()) / len(lengths) if lengths else 0.0
+
+    return {
+        "documents": documents,
+        "lengths": lengths,
+        "average_length": average_length,
+        "document_frequency": document_frequency,
+        "neighbours": neighbours
+    }
+
+def score_tables(index, question):
+    """Score every table against question, best match first"""
+    query_terms = set(tokenize(question))
+    total = len(index["documents"])
+    scores = []
+
+    for table_name, terms in index["documents"].items():
+        length_norm = 1 - BM25_B + BM25_B * index["lengths"][table_name] / (index["average_length"] or 1)
+        score = 0.0
+        for term in query_terms:
+            frequency = terms.get(term, 0)
+            if not frequency:
+                continue
+            df = index["document_frequency"][term]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        scores.append((score, table_name))
+
+    scores.sort(key=lambda item: (-item[0], item[1]))
+    return scores
+
+def select_schema(schema, question, top_k=SCHEMA_TOP_K, token_budget=SCHEMA_TOKEN_BUDGET):
+    """Pick the schema text to send to the LLM for question
+
+    Returns a dict with the schema text, the tables it covers and whether
+    the full schema was used because retrieval was not confident.
+    """
+    tables = schema["tables"]
+    index = schema.get("index")
+
+    def full_schema():
+        return {"schema": schema["table_info"], "tables": list(tables), "fallback": True}
+
+    if index is None or len(tables) <= top_k:
+        return full_schema()
+
+    scores = score_tables(index, question)
+    if not scores or scores[0][0] < SCHEMA_MIN_SCORE:
+        return full_schema()
+
+    # Top matches first, then the tables they join to
+    ranked = [name for score, name in scores[:top_k] if score > 0]
+    candidates = list(ranked)
+    for table_name in ranked:
+        for neighbour in sorted(index["neighbours"].get(table_name, ())):
+            if neighbour not in candidates:
+                candidates.append(neighbour)
+
+    selected = []
+    used_tokens = 0
+    for table_name in candidates:
+        table_tokens = estimate_tokens(tables[table_name])
+        if selected and used_tokens + table_tokens > token_budget:
+            continue
+        selected.append(table_name)
+        used_tokens += table_tokens
+
+    return {
+        "schema": "\n\n".join(tables[name] for name in sorted(selected)),
+        "tables": selected,
+        "fallback": False
+    }
@@ -0,0 +1,123 @@
+# mod/sql_cache.py - Persistent cache of generated SQL
+
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from modules.db_utils import db_cursor
+from modules.sql_utils import is_read_only
+
+# Cache settings
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "1") == "1"
+SQL_CACHE_TTL = int(os.getenv("SQL_CACHE_TTL", str(7 * 24 * 3600)))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "10000"))
+SQL_CACHE_HISTORY_TURNS = int(os.getenv("SQL_CACHE_HISTORY_TURNS", "2"))
+
+# Prune expired and least recently used rows after this many inserts
+SQL_CACHE_PRUNE_EVERY = 100
+
+_stats = {"hits": 0, "misses": 0, "stores": 0}
+_stats_lock = threading.Lock()
+
+def normalize_question(question):
+    """Normalize a question so trivial differences share a cache entry"""
+    question = unicodedata.normalize("NFKC", question).lower()
+    question = re.sub(r"\s+", " ", question).strip()
+    return question.rstrip("?!. ")
+
+def history_digest(history_rows):
+    """Digest the user's previous questions, which follow-up questions depend on
+
+    The current question is saved with the rest of its turn once the turn
+    is done, so history_rows never contains it.
+    """
+    turns = [row['content'] for row in history_rows if not row['is_system']]
+    recent = turns[-SQL_CACHE_HISTORY_TURNS:] if SQL_CACHE_HISTORY_TURNS else []
+    payload = "\n".join(normalize_question(turn) for turn in recent)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def get_cache_key(question, db_id, schema_fingerprint, history_rows):
+    """Build the cache key for a question asked against a schema"""
+    parts = [
+        normalize_question(question),
+        str(db_id),
+        schema_fingerprint or "",
+        history_digest(history_rows)
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+def _record(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+        return _stats[counter]
+
+def get_cached_sql(cache_key):
+    """Return the cached SQL for cache_key, or None on a miss"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            SELECT generated_sql FROM sql_cache
+            WHERE cache_key = %s AND created_at > NOW() - INTERVAL %s SECOND
+            """,
+            (cache_key, SQL_CACHE_TTL)
+        )
+        row = cursor.fetchone()
+
+        if row:
+            cursor.execute(
+                "UPDATE sql_cache SET hit_count = hit_count + 1, last_used_at = NOW() WHERE cache_key = %s",
+                (cache_key,)
+            )
+
+    # Writes cached before they were excluded are never replayed
+    if row and not is_read_only(row[0]):
+        row = None
+
+    _record("hits" if row else "misses")
+    return row[0] if row else None
+
+def save_cached_sql(cache_key, question, generated_sql):
+    """Store generated SQL under cache_key"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            INSERT INTO sql_cache (cache_key, question, generated_sql)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                generated_sql = VALUES(generated_sql),
+                created_at = NOW(),
+                last_used_at = NOW()
+            """,
+            (cache_key, question, generated_sql)
+        )
+
+    if _record("stores") % SQL_CACHE_PRUNE_EVERY == 0:
+        prune_sql_cache()
+
+def prune_sql_cache():
+    """Delete expired entries and the least recently used ones over the size limit"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "DELETE FROM sql_cache WHERE created_at <= NOW() - INTERVAL %s SECOND",
+            (SQL_CACHE_TTL,)
+        )
+        cursor.execute(
+            """
+            DELETE FROM sql_cache
+            WHERE last_used_at < (
+                SELECT cutoff FROM (
+                    SELECT last_used_at AS cutoff FROM sql_cache
+                    ORDER BY last_used_at DESC
+                    LIMIT 1 OFFSET %s
+                ) AS oldest_kept
+            )
+            """,
+            (SQL_CACHE_MAX_ENTRIES - 1,)
+        )
+
+def get_sql_cache_stats():
+    """Return hit/miss counters for this process"""
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(_stats, hit_rate=_stats["hits"] / lookups if lookups else 0.0)
@@ -0,0 +1,76 @@
+# mod/sql_utils.py - Lightweight classification of generated SQL
+
+import re
+
+READ_ONLY_STATEMENTS = {"select", "show", "describe", "desc", "explain", "with", "values"}
+
+# REPLACE() and INSERT() are also MySQL string functions, so only their INTO forms count;
+# any INTO (SELECT ... INTO new_table, INTO OUTFILE, INTO @var) writes somewhere
+WRITE_KEYWORDS = re.compile(
+    r"\b(into|update|delete|merge|create|alter|drop|truncate|rename|grant|revoke|call|lock|for\s+update)\b",
+    re.IGNORECASE
+)
+
+# A possibly quoted, possibly schema-qualified identifier
+IDENTIFIER = r"""[`"\[]?[\w$]+[`"\]]?(?:\.[`"\[]?[\w$]+[`"\]]?)*"""
+
+WRITE_TARGETS = re.compile(
+    r"""\b(?:insert\s+(?:ignore\s+)?into|replace\s+into|update|delete\s+from|truncate(?:\s+table)?|
+        (?:drop|alter|create)\s+(?:temporary\s+)?table(?:\s+if\s+(?:not\s+)?exists)?|rename\s+table)
+        \s+(""" + IDENTIFIER + ")",
+    re.IGNORECASE | re.VERBOSE
+)
+
+TABLE_REFERENCES = re.compile(
+    r"""\b(?:from|join|into|update|table(?:\s+if\s+(?:not\s+)?exists)?)\s+(""" + IDENTIFIER + r"""
+        (?:\s*,\s*""" + IDENTIFIER + r"""(?:\s+(?:as\s+)?\w+)?)*)""",
+    re.IGNORECASE | re.VERBOSE
+)
+
+def strip_comments_and_literals(sql):
+    """Blank out comments and quoted string literals so keywords inside them are ignored"""
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"(--|#)[^\n]*", " ", sql)
+    return re.sub(r"'(?:[^'\\]|\\.|'')*'", "''", sql)
+
+def normalize_sql(sql):
+    """Normalize whitespace, comments and the trailing semicolon of a statement"""
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+def first_keyword(sql):
+    """Return the lowercase leading keyword of a statement"""
+    match = re.match(r"\s*\(*\s*(\w+)", strip_comments_and_literals(sql))
+    return match.group(1).lower() if match else ""
+
+def is_multi_statement(sql):
+    """Check whether sql holds more than one statement"""
+    return ";" in strip_comments_and_literals(sql).strip().rstrip(";")
+
+def is_read_only(sql):
+    """Check whether a single statement only reads data"""
+    if is_multi_statement(sql):
+        return False
+    if first_keyword(sql) not in READ_ONLY_STATEMENTS:
+        return False
+    return WRITE_KEYWORDS.search(strip_comments_and_literals(sql)) is None
+
+def _table_name(token):
+    """Strip quoting and schema qualification from a table reference"""
+    name = token.strip().split()[0].split(".")[-1]
+    return name.strip('`"[]').lower()
+
+def referenced_tables(sql):
+    """Return the set of table names a statement reads or writes"""
+    tables = set()
+    for match in TABLE_REFERENCES.finditer(strip_comments_and_literals(sql)):
+        for token in match.group(1).split(","):
+            if token.strip():
+                tables.add(_table_name(token))
+    return tables
+
+def written_tables(sql):
+    """Return the set of tables a statement writes, or None if they cannot be determined"""
+    tables = {_table_name(match.group(1)) for match in WRITE_TARGETS.finditer(strip_comments_and_literals(sql))}
+    return tables or None
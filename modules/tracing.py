@@ -0,0 +1,158 @@
+# mod/tracing.py - Per-turn stage spans, token counts and a Prometheus metrics endpoint
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serve /metrics on this port when set (e.g. METRICS_PORT=9464)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Upper bounds of the stage duration histogram buckets, in seconds
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger(__name__)
+
+_metrics_lock = threading.Lock()
+_stage_histograms = {}
+_token_counters = {}
+_counters = {"turns": 0, "result_rows": 0}
+_gauges = {}
+_server = None
+
+def new_trace():
+    """Start the trace of one chat turn
+
+    stages maps a stage name to its duration in seconds, tokens maps an
+    LLM call ("sql", "answer") to its prompt and response token counts.
+    preflight holds the action and row estimate of the cost guard,
+    routed_to the server that ran the query.
+    """
+    return {"stages": {}, "tokens": {}, "row_count": None, "preflight": None, "routed_to": None}
+
+@contextmanager
+def span(trace, name):
+    """Record how long the with-block takes as stage name of trace (None disables it)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace["stages"][name] = time.perf_counter() - start
+
+def token_usage(trace, call):
+    """Return the dict an LLM call fills with its token counts, or None without a trace"""
+    if trace is None:
+        return None
+    return trace["tokens"].setdefault(call, {})
+
+def trace_record(trace):
+    """Summarize a trace for storage with its query row"""
+    tokens = trace["tokens"].values()
+    return {
+        "duration_ms": round(trace["stages"].get("total", sum(trace["stages"].values())) * 1000),
+        "prompt_tokens": sum(usage.get("prompt_tokens", 0) for usage in tokens),
+        "response_tokens": sum(usage.get("response_tokens", 0) for usage in tokens),
+        "row_count": trace["row_count"],
+        "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in trace["stages"].items()},
+        "tokens": {call: dict(usage) for call, usage in trace["tokens"].items()},
+        "preflight": trace.get("preflight"),
+        "routed_to": trace.get("routed_to")
+    }
+
+def record_turn(trace):
+    """Add a finished turn to the process-wide metrics"""
+    with _metrics_lock:
+        _counters["turns"] += 1
+        _counters["result_rows"] += trace["row_count"] or 0
+
+        for name, seconds in trace["stages"].items():
+            histogram = _stage_histograms.setdefault(
+                name, {"buckets": [0] * len(STAGE_BUCKETS), "sum": 0.0, "count": 0}
+            )
+            for index, bound in enumerate(STAGE_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+        for call, usage in trace["tokens"].items():
+            for kind in ("prompt_tokens", "response_tokens"):
+                key = (call, kind.split("_")[0])
+                _token_counters[key] = _token_counters.get(key, 0) + usage.get(kind, 0)
+
+def register_gauge(name, help_text, function):
+    """Export function() as gauge lang2sql_<name>, read at every scrape"""
+    _gauges[name] = (help_text, function)
+
+def render_metrics():
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    with _metrics_lock:
+        lines.append("# HELP lang2sql_turns_total Chat turns answered.")
+        lines.append("# TYPE lang2sql_turns_total counter")
+        lines.append(f"lang2sql_turns_total {_counters['turns']}")
+
+        lines.append("# HELP lang2sql_result_rows_total Rows returned by generated queries.")
+        lines.append("# TYPE lang2sql_result_rows_total counter")
+        lines.append(f"lang2sql_result_rows_total {_counters['result_rows']}")
+
+        lines.append("# HELP lang2sql_llm_tokens_total LLM tokens per call and direction.")
+        lines.append("# TYPE lang2sql_llm_tokens_total counter")
+        for (call, kind), count in sorted(_token_counters.items()):
+            lines.append(f'lang2sql_llm_tokens_total{{call="{call}",kind="{kind}"}} {count}')
+
+        lines.append("# HELP lang2sql_turn_stage_seconds Duration of the stages of a chat turn.")
+        lines.append("# TYPE lang2sql_turn_stage_seconds histogram")
+        for name, histogram in sorted(_stage_histograms.items()):
+            for bound, count in zip(STAGE_BUCKETS, histogram["buckets"]):
+                lines.append(f'lang2sql_turn_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'lang2sql_turn_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'lang2sql_turn_stage_seconds_sum{{stage="{name}"}} {histogram["sum"]}')
+            lines.append(f'lang2sql_turn_stage_seconds_count{{stage="{name}"}} {histogram["count"]}')
+
+    for name, (help_text, function) in sorted(_gauges.items()):
+        try:
+            value = function()
+        except Exception:
+            logger.exception("Reading gauge %s failed", name)
+            continue
+        lines.append(f"# HELP lang2sql_{name} {help_text}")
+        lines.append(f"# TYPE lang2sql_{name} gauge")
+        lines.append(f"lang2sql_{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics on host:port from a daemon thread (once per process; port 0 disables it)"""
+    global _server
+    if not port:
+        return
+    with _metrics_lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError:
+            logger.exception("Could not serve metrics on %s:%s", host, port)
+            return
+    threading.Thread(target=_server.serve_forever, name="lang2sql-metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)